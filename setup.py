@@ -22,8 +22,9 @@ setup(
     },
     entry_points="""
     [console_scripts]
-    stolos=stolos.cli:cli
-    stolosctl=stolos.cli:cli
+    stolos=stolos.cli:main
+    stolosctl=stolos.cli:main
+    stolosd=stolos.daemon:main
     """,
     classifiers=[
         "Development Status :: 5 - Production/Stable",
@@ -0,0 +1,155 @@
+"""
+Asyncio API client for use in the Stolos CLI. Requests are run on a thread
+pool, through the pooled sessions and error handling of `stolos.api`, while a
+semaphore bounds how many of them are in flight at once.
+"""
+import asyncio
+import collections
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from click.exceptions import ClickException
+
+from stolos import api, daemon
+
+
+# Default number of concurrent requests, matching the connection pool size.
+DEFAULT_CONCURRENCY = api.DEFAULT_POOL_SIZE
+
+# The outcome of a single call, as yielded by `iter_completed`.
+Result = collections.namedtuple("Result", ["key", "value", "error", "elapsed"])
+
+
+class AsyncClient(object):
+    """
+    Asynchronous counterpart of the functions in `stolos.api`. Errors are
+    translated exactly like in the synchronous API, raising the appropriate
+    `exceptions.*` error.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(concurrency)
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Runs the given blocking function on the thread pool, waiting for a free
+        slot first. Paginated list endpoints are consumed in full on the pool,
+        as part of the `stolosd` command of this thread, if any.
+        """
+        async with self.semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                daemon.bind(functools.partial(_consume, func, *args, **kwargs)),
+            )
+
+    async def timed(self, key, func, *args, **kwargs):
+        """
+        Runs the given function like `call`, returning a `Result` instead of
+        raising any API error.
+        """
+        start = time.time()
+        try:
+            value = await self.call(func, *args, **kwargs)
+        except ClickException as err:
+            return Result(key, None, err, time.time() - start)
+        return Result(key, value, None, time.time() - start)
+
+    async def stacks_list(self, credentials):
+        return await self.call(api.stacks_list, credentials)
+
+    async def projects_list(self, credentials):
+        return await self.call(api.projects_list, credentials)
+
+    async def projects_retrieve(self, credentials, project_uuid):
+        return await self.call(api.projects_retrieve, credentials, project_uuid)
+
+    async def projects_create(self, credentials, stack, public_url, subdomains):
+        return await self.call(
+            api.projects_create, credentials, stack, public_url, subdomains
+        )
+
+    async def projects_remove(self, credentials, project_uuid):
+        return await self.call(api.projects_remove, credentials, project_uuid)
+
+    async def keys_list(self, credentials):
+        return await self.call(api.keys_list, credentials)
+
+    async def keys_create(self, credentials, ssh_public_key, name=None):
+        return await self.call(api.keys_create, credentials, ssh_public_key, name)
+
+    async def keys_remove(self, credentials, public_key_uuid):
+        return await self.call(api.keys_remove, credentials, public_key_uuid)
+
+    async def projects_retrieve_many(self, credentials, project_uuids):
+        """
+        Retrieves the projects with the given UUIDs concurrently, returning them
+        in the same order.
+        """
+        return await asyncio.gather(
+            *[self.projects_retrieve(credentials, uuid) for uuid in project_uuids]
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def _consume(func, *args, **kwargs):
+    """
+    Calls the given function, consuming its result in full if it is a
+    generator, like the paginated list endpoints.
+    """
+    result = func(*args, **kwargs)
+    if inspect.isgenerator(result):
+        return list(result)
+    return result
+
+
+def iter_completed(calls, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Runs the given calls concurrently, yielding a `Result` for each one as soon
+    as it completes, so that callers are not blocked by the slowest call.
+
+    Each call is a `(key, func, args)` tuple, where `func` is any of the
+    blocking functions of `stolos.api`.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = AsyncClient(concurrency)
+    pending = set()
+    try:
+        for key, func, args in calls:
+            pending.add(loop.create_task(client.timed(key, func, *args)))
+        while pending:
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        client.close()
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def run(coroutine_function, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Runs the given coroutine function to completion on a new event loop,
+    passing it an `AsyncClient`, and returns its result.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = AsyncClient(concurrency)
+    try:
+        return loop.run_until_complete(coroutine_function(client))
+    finally:
+        client.close()
+        asyncio.set_event_loop(None)
+        loop.close()
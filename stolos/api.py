@@ -1,12 +1,38 @@
 """
 API client for use in the Stolos CLI.
 """
+import inspect
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
 from functools import wraps
 
 import click
 import requests
+from requests.adapters import HTTPAdapter
 
-from stolos import exceptions
+from stolos import cache, exceptions
+
+
+# Default number of connections kept alive per Stolos API server.
+DEFAULT_POOL_SIZE = 10
+
+# Default `(connect, read)` timeout in seconds, for every API request.
+DEFAULT_TIMEOUT = (10, 60)
+
+# HTTP methods that can be safely repeated, as they have no extra side effects.
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+# Response status codes denoting a transient failure, worth retrying.
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+# Clients already created in this process, keyed by API server URL and mapped
+# to an `(options, client)` tuple, along with the lock guarding them, as they
+# are shared by the threads of `stolos.aio`.
+_clients = {}
+_clients_lock = threading.Lock()
 
 
 def _urljoin(*args):
@@ -23,38 +49,365 @@ def _ensure_protocol(url):
     return url
 
 
+def _retry_after(response):
+    """
+    Returns the seconds to wait according to the `Retry-After` header of the
+    given response, either in seconds or as an HTTP date, or None.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - time.time())
+
+
+class RetryPolicy(object):
+    """
+    Decides if and when a failed request should be retried. Waits grow
+    exponentially with full jitter, honouring `Retry-After` on 429 and 503
+    responses. Only idempotent requests are retried by default, except for
+    connection timeouts where the request never reached the server.
+
+    `budget` is the total number of retries allowed for the lifetime of the
+    policy, so that a struggling server is not hammered by a long running
+    command. It is shared by all the threads using the policy. `max_retry_after` is the longest `Retry-After` honoured, beyond
+    which the request is not retried.
+    """
+
+    def __init__(
+        self,
+        retries=3,
+        backoff=0.25,
+        max_backoff=10,
+        budget=20,
+        max_retry_after=120,
+        methods=IDEMPOTENT_METHODS,
+        statuses=RETRY_STATUSES,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.max_retry_after = max_retry_after
+        self.lock = threading.Lock()
+        self.methods = methods
+        self.statuses = statuses
+
+    def delay_for_response(self, method, response, attempt):
+        """
+        Returns the seconds to wait before retrying the request that got the
+        given response, or None if it should not be retried.
+        """
+        if response.status_code not in self.statuses:
+            return None
+        if method.upper() not in self.methods:
+            return None
+        if response.status_code in (429, 503):
+            retry_after = _retry_after(response)
+            if retry_after is not None:
+                if retry_after > self.max_retry_after:
+                    return None
+                return self._consume(attempt, retry_after)
+        return self._consume(attempt)
+
+    def delay_for_error(self, method, error, attempt):
+        """
+        Returns the seconds to wait before retrying the request that raised the
+        given connection error or timeout, or None if it should not be
+        retried.
+        """
+        if not isinstance(error, requests.exceptions.ConnectTimeout):
+            if method.upper() not in self.methods:
+                return None
+        return self._consume(attempt)
+
+    def _consume(self, attempt, delay=None):
+        with self.lock:
+            if attempt >= self.retries or self.budget <= 0:
+                return None
+            self.budget -= 1
+        if delay is None:
+            cap = min(self.max_backoff, self.backoff * (2 ** attempt))
+            delay = random.uniform(0, cap)
+        return delay
+
+
+class Client(object):
+    """
+    HTTP client for a single Stolos API server. Keeps a pooled
+    `requests.Session`, so that consecutive requests to the same server reuse
+    the same keep-alive connections instead of doing a new TCP and TLS
+    handshake each time.
+    """
+
+    def __init__(
+        self,
+        host,
+        token=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        keep_alive=True,
+        retry=None,
+        cache_ttl=0,
+    ):
+        self.host = _ensure_protocol(host)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.set_token(token)
+
+    def set_token(self, token):
+        """
+        Sets the authentication token sent with every request of this client.
+        """
+        self.token = token
+        if token:
+            self.session.headers["Authorization"] = "Token {}".format(token)
+        else:
+            self.session.headers.pop("Authorization", None)
+
+    def url(self, *path):
+        """
+        Returns the full URL of the given API path. A single absolute URL, like
+        the `next` link of a paginated response, is returned as is.
+        """
+        if len(path) == 1 and "://" in str(path[0]):
+            return path[0]
+        return _urljoin(self.host, *path)
+
+    def request(self, method, *path, **kwargs):
+        """
+        Performs a request to the given API path, using the pooled session and
+        the default timeout of this client. Transient failures are retried,
+        according to the retry policy of this client.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(*path)
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as err:
+                delay = self.retry.delay_for_error(method, err, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.retry.delay_for_response(method, resp, attempt)
+                if delay is None:
+                    return resp
+                resp.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, *path, **kwargs):
+        return self.request("GET", *path, **kwargs)
+
+    def get_json(self, *path):
+        """
+        Returns the decoded JSON body of a GET request to the given API path,
+        using the on-disk response cache. Cached entries younger than the
+        cache TTL of this client are returned as is, older ones are
+        revalidated using `If-None-Match` and `If-Modified-Since`.
+        """
+        url = self.url(*path)
+        entry = cache.load(self.host, url, self.token)
+        headers = {}
+        if entry is not None:
+            if time.time() - entry["stored"] < self.cache_ttl:
+                return entry["data"]
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last-modified"]:
+                headers["If-Modified-Since"] = entry["last-modified"]
+        resp = self.get(*path, headers=headers)
+        if resp.status_code == 304 and entry is not None:
+            cache.store(
+                self.host,
+                url,
+                self.token,
+                entry["data"],
+                etag=entry["etag"],
+                last_modified=entry["last-modified"],
+            )
+            return entry["data"]
+        resp.raise_for_status()
+        data = resp.json()
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if etag or last_modified or self.cache_ttl:
+            cache.store(
+                self.host, url, self.token, data, etag=etag, last_modified=last_modified
+            )
+        return data
+
+    def invalidate_cache(self):
+        """
+        Drops the cached responses of this API server, after modifying any of
+        its resources.
+        """
+        cache.invalidate(self.host)
+
+    def post(self, *path, **kwargs):
+        return self.request("POST", *path, **kwargs)
+
+    def delete(self, *path, **kwargs):
+        return self.request("DELETE", *path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def _paginate(client, *path):
+    """
+    Yields the items of the given list endpoint, one page at a time. Follows
+    the `next` link of paginated responses, while plain list responses are
+    yielded as they are.
+    """
+    page = client.get_json(*path)
+    while True:
+        if isinstance(page, list):
+            for item in page:
+                yield item
+            return
+        for item in page.get("results", []):
+            yield item
+        if not page.get("next"):
+            return
+        page = client.get_json(page["next"])
+
+
+def _client_options(credentials):
+    """
+    Returns the options of the client for the given credentials.
+    """
+    timeout = credentials.get("timeout", DEFAULT_TIMEOUT)
+    if isinstance(timeout, list):
+        timeout = tuple(timeout)
+    return {
+        "pool_size": credentials.get("pool-size", DEFAULT_POOL_SIZE),
+        "timeout": timeout,
+        "keep_alive": credentials.get("keep-alive", True),
+        "retries": credentials.get("retries", 3),
+        "retry_budget": credentials.get("retry-budget", 20),
+        "cache_ttl": credentials.get("cache-ttl", 0),
+    }
+
+
+def _retry_policy(options):
+    return RetryPolicy(retries=options["retries"], budget=options["retry_budget"])
+
+
+def get_client(credentials):
+    """
+    Returns the client for the API server of the given credentials, creating it
+    if needed. Accepts either the credentials dict of a logged in user, or
+    just the URL of the API server.
+
+    Connection pool size, keep-alive, timeout, retries and response caching
+    can be configured for each API server, using the `pool-size`,
+    `keep-alive`, `timeout`, `retries`, `retry-budget` and `cache-ttl` keys of
+    its credentials. The client is created again when they change.
+    """
+    if not isinstance(credentials, dict):
+        credentials = {"host": credentials}
+    host = _ensure_protocol(credentials["host"])
+    options = _client_options(credentials)
+    with _clients_lock:
+        cached = _clients.get(host)
+        if cached is not None and cached[0] == options:
+            client = cached[1]
+        else:
+            if cached is not None:
+                cached[1].close()
+            client = Client(
+                host,
+                pool_size=options["pool_size"],
+                timeout=options["timeout"],
+                keep_alive=options["keep_alive"],
+                retry=_retry_policy(options),
+                cache_ttl=options["cache_ttl"],
+            )
+            _clients[host] = (options, client)
+        client.set_token(credentials.get("token"))
+    return client
+
+
+def reset_retries():
+    """
+    Gives every client created so far a fresh retry policy, with its whole
+    retry budget, as the budget is meant for a single command, while clients
+    outlive commands in `stolosd`.
+    """
+    with _clients_lock:
+        for options, client in _clients.values():
+            client.retry = _retry_policy(options)
+
+
+@contextmanager
+def _translate_api_errors():
+    """
+    Context manager catching `requests.exceptions.HTTPError` and throwing the
+    appropriate `exceptions.*` error.
+    """
+    try:
+        yield
+    except requests.exceptions.HTTPError as err:
+        if err.response.status_code // 100 == 5:
+            raise exceptions.ServerError(err.response.text)
+        elif err.response.status_code in [401, 403]:
+            raise exceptions.Unauthorized(err.response.json())
+        elif err.response.status_code == 400:
+            raise exceptions.BadRequest(err.response.json())
+        elif err.response.status_code == 404:
+            try:
+                raise exceptions.ResourceDoesNotExist(err.response.json())
+            except ValueError:
+                raise exceptions.ResourceDoesNotExist(err.response.text)
+        elif err.response.status_code == 409:
+            raise exceptions.ResourceAlreadyExists()
+        else:
+            raise exceptions.UnknownError(err.response.status_code, err.response.text)
+    except requests.exceptions.ConnectionError as err:
+        raise exceptions.NoInternetException()
+    except requests.exceptions.Timeout as err:
+        raise exceptions.Timeout()
+
+
 def handle_api_errors(func):
     """
     Decorator for handling API errors. Catches `requests.exceptions.HTTPError`
-    and throws the appropriate `exceptions.*` error.
+    and throws the appropriate `exceptions.*` error. Generator functions are
+    supported as well, translating errors raised while iterating them.
     """
+    if inspect.isgeneratorfunction(func):
+
+        @wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            with _translate_api_errors():
+                for item in func(*args, **kwargs):
+                    yield item
+
+        return gen_wrapper
 
     @wraps(func)
     def func_wrapper(*args, **kwargs):
-        try:
+        with _translate_api_errors():
             return func(*args, **kwargs)
-        except requests.exceptions.HTTPError as err:
-            if err.response.status_code / 100 == 5:
-                raise exceptions.ServerError(err.response.text)
-            elif err.response.status_code in [401, 403]:
-                raise exceptions.Unauthorized(err.response.json())
-            elif err.response.status_code == 400:
-                raise exceptions.BadRequest(err.response.json())
-            elif err.response.status_code == 404:
-                try:
-                    raise exceptions.ResourceDoesNotExist(err.response.json())
-                except ValueError:
-                    raise exceptions.ResourceDoesNotExist(err.response.text)
-            elif err.response.status_code == 409:
-                raise exceptions.ResourceAlreadyExists()
-            else:
-                raise exceptions.UnknownError(
-                    err.response.status_code, err.response.text
-                )
-        except requests.exceptions.ConnectionError as err:
-            raise exceptions.NoInternetException()
-        except requests.exceptions.Timeout as err:
-            raise exceptions.Timeout()
 
     return func_wrapper
 
@@ -65,9 +418,8 @@ def authenticate(stolos_url, username, password):
     Authenticate the user to the given Stolos server, using the given
     credentials. Returns the authentication token.
     """
-    url = _urljoin(stolos_url, "api/a0.1/auth/login/")
-    resp = requests.post(
-        _ensure_protocol(url), json={"username": username, "password": password}
+    resp = get_client(stolos_url).post(
+        "api/a0.1/auth/login/", json={"username": username, "password": password}
     )
     resp.raise_for_status()
     return resp.json()
@@ -78,11 +430,8 @@ def change_password(credentials, current_password, new_password):
     """
     Change a user's password.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/auth/password/")
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.post(
-        _ensure_protocol(url),
-        headers=headers,
+    resp = get_client(credentials).post(
+        "api/a0.1/auth/password/",
         json={
             "current_password": current_password,
             "new_password": new_password,
@@ -95,25 +444,21 @@ def change_password(credentials, current_password, new_password):
 @handle_api_errors
 def stacks_list(credentials):
     """
-    List the stacks accessible to the currently logged in user.
+    List the stacks accessible to the currently logged in user. Yields stacks
+    as they arrive, following the pagination of the server.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/stacks/")
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.get(_ensure_protocol(url), headers=headers)
-    resp.raise_for_status()
-    return resp.json()
+    for item in _paginate(get_client(credentials), "api/a0.1/stacks/"):
+        yield item
 
 
 @handle_api_errors
 def projects_list(credentials):
     """
-    List the projects of the currently logged in user.
+    List the projects of the currently logged in user. Yields projects as they
+    arrive, following the pagination of the server.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/projects/")
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.get(_ensure_protocol(url), headers=headers)
-    resp.raise_for_status()
-    return resp.json()
+    for item in _paginate(get_client(credentials), "api/a0.1/projects/"):
+        yield item
 
 
 @handle_api_errors
@@ -121,11 +466,9 @@ def projects_create(credentials, stack, public_url, subdomains):
     """
     Create a new project, using the given stack and public URL.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/projects/")
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.post(
-        _ensure_protocol(url),
-        headers=headers,
+    client = get_client(credentials)
+    resp = client.post(
+        "api/a0.1/projects/",
         json={
             "set_stack": stack,
             "routing_config": {
@@ -134,6 +477,9 @@ def projects_create(credentials, stack, public_url, subdomains):
             },
         },
     )
+    # Invalidated only once changed, so that concurrent reads cannot cache
+    # responses from before the change.
+    client.invalidate_cache()
     resp.raise_for_status()
     return resp.json()
 
@@ -143,11 +489,7 @@ def projects_retrieve(credentials, project_uuid):
     """
     Retrieve the project with the given UUID.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/projects/", project_uuid)
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.get(_ensure_protocol(url), headers=headers)
-    resp.raise_for_status()
-    return resp.json()
+    return get_client(credentials).get_json("api/a0.1/projects/", project_uuid)
 
 
 @handle_api_errors
@@ -155,9 +497,9 @@ def projects_remove(credentials, project_uuid):
     """
     Remove the proejct with the given UUID.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/projects/", project_uuid)
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.delete(_ensure_protocol(url), headers=headers)
+    client = get_client(credentials)
+    resp = client.delete("api/a0.1/projects/", project_uuid)
+    client.invalidate_cache()
     try:
         resp.raise_for_status()
     except requests.exceptions.HTTPError as err:
@@ -170,13 +512,11 @@ def keys_create(credentials, ssh_public_key, name=None):
     """
     Create a new SSH public key.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/keys/")
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.post(
-        _ensure_protocol(url),
-        headers=headers,
-        json={"public_key": ssh_public_key, "name": name},
+    client = get_client(credentials)
+    resp = client.post(
+        "api/a0.1/keys/", json={"public_key": ssh_public_key, "name": name}
     )
+    client.invalidate_cache()
     try:
         resp.raise_for_status()
     except requests.exceptions.HTTPError as exc:
@@ -193,13 +533,11 @@ def keys_create(credentials, ssh_public_key, name=None):
 @handle_api_errors
 def keys_list(credentials):
     """
-    List the SSH public keys of the currently logged in user.
+    List the SSH public keys of the currently logged in user. Yields keys as
+    they arrive, following the pagination of the server.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/keys/")
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.get(_ensure_protocol(url), headers=headers)
-    resp.raise_for_status()
-    return resp.json()
+    for item in _paginate(get_client(credentials), "api/a0.1/keys/"):
+        yield item
 
 
 @handle_api_errors
@@ -207,9 +545,9 @@ def keys_remove(credentials, public_key_uuid):
     """
     Remove the SSH public key with the given UUID.
     """
-    url = _urljoin(credentials["host"], "api/a0.1/keys/", public_key_uuid)
-    headers = {"Authorization": "Token {}".format(credentials["token"])}
-    resp = requests.delete(_ensure_protocol(url), headers=headers)
+    client = get_client(credentials)
+    resp = client.delete("api/a0.1/keys/", public_key_uuid)
+    client.invalidate_cache()
     try:
         resp.raise_for_status()
     except requests.exceptions.HTTPError as err:
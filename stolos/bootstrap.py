@@ -0,0 +1,131 @@
+"""
+Bootstrap of the remote files of a project. The first sync of a project goes
+through Unison's file by file protocol, which is slow for large trees, while
+the remote directory is still empty. Instead, the tree is streamed to the
+remote as a single compressed tar over SSH, and Unison takes over from there,
+finding both sides already equal.
+
+The tree is extracted in a staging directory, under the remote `.stolos`
+directory that Unison ignores, and moved into place only once complete. A
+failed transfer leaves no partial files behind for Unison to mistake for
+newer versions of the local ones.
+"""
+import functools
+import gzip
+import os
+import shlex
+import subprocess
+import tarfile
+
+import click
+
+from stolos import ignore, ssh, tools
+
+
+# Marker file of projects that have been synced at least once.
+MARKER = ".stolos/bootstrapped"
+
+# Compression level of the stream, favouring speed over size.
+COMPRESS_LEVEL = 1
+
+# Directory the tree is extracted in, relative to the remote directory.
+STAGING_DIR = ".stolos/bootstrap"
+
+# Remote command extracting the tree to the staging directory and moving it
+# into place, or removing it if the transfer fails.
+EXTRACT_COMMAND = (
+    "rm -rf {staging} && mkdir -p {staging} && tar -xzf - -C {staging}"
+    " && find {staging} -mindepth 1 -maxdepth 1 -exec mv {{}} {directory}/ \\;"
+    " && rm -rf {staging} || {{ rm -rf {staging}; exit 1; }}"
+)
+
+
+def remote_dir(cnf):
+    return "/mnt/stolos/{}".format(cnf["project"]["uuid"])
+
+
+def is_remote_empty(command, directory):
+    """
+    Returns True if the given remote directory has no files, apart from the
+    `.stolos` directory of earlier transfers, False if it has some, or None if
+    it could not be checked.
+    """
+    try:
+        output = subprocess.check_output(
+            command + ["ls -A {}".format(shlex.quote(directory))],
+            stdin=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return not [name for name in output.splitlines() if name.strip() != b".stolos"]
+
+
+def stream_tree(command, directory):
+    """
+    Streams the current directory to the given remote directory, as a gzipped
+    tar extracted on the fly, leaving out ignored paths. Returns True if the
+    transfer succeeded, else the remote directory is left as it was.
+    """
+    matcher = ignore.load()
+    extract = EXTRACT_COMMAND.format(
+        staging=shlex.quote("{}/{}".format(directory, STAGING_DIR)),
+        directory=shlex.quote(directory),
+    )
+    try:
+        p = subprocess.Popen(command + [extract], stdin=subprocess.PIPE)
+    except OSError:
+        return False
+    try:
+        with gzip.GzipFile(
+            fileobj=p.stdin, mode="wb", compresslevel=COMPRESS_LEVEL
+        ) as stream:
+            with tarfile.open(fileobj=stream, mode="w|") as tar:
+                for name in sorted(os.listdir(os.curdir)):
+                    tar.add(name, filter=functools.partial(_filter, matcher))
+        p.stdin.close()
+    except (IOError, OSError):
+        # The remote end went away, as reported by its exit code.
+        p.kill()
+    return p.wait() == 0
+
+
+def _filter(matcher, tarinfo):
+    if matcher.matches(tarinfo.name, tarinfo.isdir()):
+        # Ignored directories are not descended into either.
+        return None
+    return tarinfo
+
+
+def bootstrap(cnf):
+    """
+    Transfers the project to its remote directory in bulk, if the project has
+    never been synced and the remote directory is empty. Returns True if the
+    files were transferred. Failures are not fatal, as the sync that follows
+    transfers any missing files anyway.
+
+    Projects found with remote files are marked as synced, so that the remote
+    is checked only once.
+    """
+    if os.path.exists(MARKER):
+        return False
+    command = ssh.command(cnf, tools.get_identity_file(cnf))
+    directory = remote_dir(cnf)
+    empty = is_remote_empty(command, directory)
+    if empty is False:
+        mark_synced()
+    if not empty:
+        return False
+    click.echo("Transferring files...")
+    if not stream_tree(command, directory):
+        click.echo("There was an error transferring your files, syncing instead")
+        return False
+    return True
+
+
+def mark_synced():
+    """
+    Records that the project has been synced, so that later syncs do not check
+    whether it needs to be bootstrapped.
+    """
+    with open(MARKER, "w"):
+        pass
@@ -0,0 +1,137 @@
+"""
+On-disk cache of API responses, for use in the Stolos CLI. Entries are
+revalidated against the server using conditional requests, unless they are
+still fresh according to a time to live.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import click
+
+
+# Maximum total size of the cached responses, in bytes.
+MAX_SIZE = 8 * 1024 * 1024
+
+# Environment variable disabling the cache, set by `stolos --no-cache`. The
+# environment is per command in `stolosd`, unlike module state.
+NO_CACHE_VAR = "STOLOS_NO_CACHE"
+
+
+def is_enabled():
+    """
+    Returns True if cached responses should be used at all.
+    """
+    return os.environ.get(NO_CACHE_VAR) != "1"
+
+
+def _hash(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _cache_dir():
+    return os.path.join(click.get_app_dir("Stolos"), "cache")
+
+
+def _host_dir(host):
+    return os.path.join(_cache_dir(), _hash(host)[:16])
+
+
+def _entry_path(host, url, token):
+    """
+    Returns the path of the cache entry for the given URL. Entries are
+    partitioned per API server and keyed by a hash of the token, so that
+    responses are never shared across users.
+    """
+    key = _hash("{}\n{}".format(url, _hash(token or "")))
+    return os.path.join(_host_dir(host), key + ".json")
+
+
+def load(host, url, token):
+    """
+    Returns the cache entry for the given URL, or None if there is none.
+    """
+    if not is_enabled():
+        return None
+    path = _entry_path(host, url, token)
+    try:
+        with open(path, "r") as fin:
+            entry = json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
+    # Mark the entry as recently used, for eviction.
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return entry
+
+
+def store(host, url, token, data, etag=None, last_modified=None):
+    """
+    Stores the given response data for the given URL, along with the validators
+    needed to revalidate it later.
+    """
+    if not is_enabled():
+        return
+    path = _entry_path(host, url, token)
+    entry = {
+        "stored": time.time(),
+        "etag": etag,
+        "last-modified": last_modified,
+        "data": data,
+    }
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fout:
+            json.dump(entry, fout)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        return
+    evict()
+
+
+def invalidate(host):
+    """
+    Removes all cached responses of the given API server, for use after
+    modifying any of its resources.
+    """
+    directory = _host_dir(host)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def evict(max_size=MAX_SIZE):
+    """
+    Removes the least recently used entries, until the total size of the cache
+    is below `max_size` bytes.
+    """
+    entries = []
+    total = 0
+    for root, _, files in os.walk(_cache_dir()):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    entries.sort()
+    while total > max_size and entries:
+        _, size, path = entries.pop(0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
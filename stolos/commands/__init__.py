@@ -0,0 +1,3 @@
+"""
+Commands of the Stolos CLI, loaded lazily by `stolos.cli`.
+"""
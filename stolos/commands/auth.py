@@ -0,0 +1,90 @@
+"""
+Commands for authenticating to Stolos servers.
+"""
+import os
+
+import click
+
+from stolos import api, config, utils
+from stolos.commands.keys import upload
+
+
+@click.command(help="Log in to a Stolos environment")
+@click.option("--username", prompt=True, help="Your Stolos username")
+@click.option(
+    "--password",
+    prompt="Password (typing will be hidden)",
+    hide_input=True,
+    help="Your stolos password",
+)
+@click.option(
+    "--stolos-url",
+    default="https://api.stolos.io",
+    help="The URL of the Stolos server to use",
+)
+@click.pass_context
+def login(ctx, **kwargs):
+    stolos_url = api._ensure_protocol(kwargs["stolos_url"])
+    host = utils.get_hostname(stolos_url)
+    cnf = config.get_user_config()
+    identity_file = cnf.get("user", {}).get(host, {}).get("identity-file")
+    auth_response = api.authenticate(**kwargs)
+    new_config = {
+        "token": auth_response["auth_token"],
+        "key-pem": auth_response["docker_key_pem"],
+        "cert-pem": auth_response["docker_cert_pem"],
+        "username": kwargs["username"],
+        "host": stolos_url,
+    }
+    if identity_file:
+        new_config["identity-file"] = identity_file
+    # Write all the resulting config updates at once, including the identity
+    # file stored by `upload`.
+    with config.transaction():
+        config.update_user_config({"user": {host: new_config}})
+        if "default-api-server" not in config.get_user_config()["user"]:
+            config.update_user_config({"user": {"default-api-server": host}})
+        click.echo("Authentication successful.")
+        if identity_file is not None:
+            return
+        home = os.path.expanduser("~")
+        key_path = os.path.join(home, ".ssh", "id_rsa")
+        public_key_path = key_path + ".pub"
+        if os.path.exists(key_path) and os.path.exists(public_key_path):
+            ctx.invoke(upload, public_key_path=public_key_path, stolos_url=host)
+        else:
+            click.echo(
+                "No ssh key was found. To enable stolos syncing, upload a public ssh key using the following command:"
+            )
+            click.secho("\tstolos keys upload [PUBLIC_KEY_PATH]\n", bold=True)
+
+
+@click.command(help="Change your Stolos password")
+@click.option(
+    "--password",
+    prompt="Current password (typing will be hidden)",
+    hide_input=True,
+    help="Your current stolos password",
+)
+@click.option(
+    "--new-password",
+    prompt="New password (typing will be hidden)",
+    hide_input=True,
+    help="Your new stolos password",
+    confirmation_prompt=True,
+)
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+def password(**kwargs):
+    cnf = config.get_config()
+    stolos_url = kwargs.get("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    utils.ensure_logged_in(stolos_url)
+    api.change_password(
+        cnf["user"][utils.get_hostname(stolos_url)],
+        kwargs["password"],
+        kwargs["new_password"],
+    )
+    click.echo("Password successfully updated.")
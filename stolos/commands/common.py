@@ -0,0 +1,150 @@
+"""
+Helpers shared by the commands managing Stolos API resources.
+"""
+import collections
+import itertools
+
+import click
+from six import iteritems
+from tabulate import tabulate
+
+from stolos import config, exceptions
+
+
+def stack_row(stack):
+    """
+    Returns the table row of the given stack, as returned by the API.
+    """
+    return (stack["name"], stack["slug"], stack.get("description"))
+
+
+def project_row(project):
+    """
+    Returns the table row of the given project, as returned by the API.
+    """
+    stack = "-"
+    if project["stack"]:
+        stack = project["stack"]["slug"]
+    return (project["uuid"], stack, project["routing_config"]["domain"])
+
+
+def echo_table(rows, headers, chunk_size=50):
+    """
+    Prints the given rows as a table, while they are still being fetched.
+    Column widths are computed from the first `chunk_size` rows, so that
+    output starts without waiting for the rest of the rows; later rows that do
+    not fit just widen their own line.
+    """
+    rows = iter(rows)
+    first_rows = list(itertools.islice(rows, chunk_size))
+    table = tabulate(first_rows, headers=headers)
+    click.echo(table)
+    widths = [len(column) for column in table.splitlines()[1].split("  ")]
+    for row in rows:
+        cells = [
+            ("" if cell is None else str(cell)).ljust(width)
+            for cell, width in zip(row, widths)
+        ]
+        click.echo("  ".join(cells).rstrip())
+
+
+def read_uuids(fin):
+    """
+    Reads UUIDs from the given file, one per line, skipping empty lines and
+    comments.
+    """
+    uuids = []
+    for line in fin:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            uuids.append(line)
+    return uuids
+
+
+def bulk_delete(ctx, remove_func, credentials, uuids, parallel):
+    """
+    Deletes the resources with the given UUIDs concurrently, using at most
+    `parallel` requests at once. Reports progress as each deletion completes,
+    followed by a table with the result of each one.
+    """
+    from stolos import aio
+
+    # Keep the given order, but delete each resource only once.
+    uuids = list(collections.OrderedDict.fromkeys(uuids))
+    if not uuids:
+        click.echo("Nothing to delete.")
+        return
+    calls = [(uuid, remove_func, (credentials, uuid)) for uuid in uuids]
+    results = []
+    for result in aio.iter_completed(calls, concurrency=parallel):
+        results.append(result)
+        status = "Okay." if result.error is None else "Failed."
+        click.echo(
+            '[{}/{}] Deleting "{}"...\t\t{}'.format(
+                len(results), len(uuids), result.key, status
+            )
+        )
+    failures = [result for result in results if result.error is not None]
+    order = {uuid: index for index, uuid in enumerate(uuids)}
+    rows = [
+        (
+            result.key,
+            "Okay" if result.error is None else result.error.format_message(),
+            "{:.2f}s".format(result.elapsed),
+        )
+        for result in sorted(results, key=lambda result: order[result.key])
+    ]
+    click.echo("")
+    click.echo(tabulate(rows, headers=["UUID", "Result", "Time"]))
+    click.echo("")
+    click.echo("Deleted {} of {}.".format(len(results) - len(failures), len(uuids)))
+    if failures:
+        ctx.exit(1)
+
+
+def logged_in_servers(cnf):
+    """
+    Returns the hosts of all the Stolos servers the user is logged in.
+    """
+    return sorted(
+        host
+        for host, server in iteritems(cnf.get("user", {}))
+        if isinstance(server, dict) and "token" in server
+    )
+
+
+def echo_all_servers(ctx, list_func, row_func, headers):
+    """
+    Lists resources from all the logged in Stolos servers concurrently. Rows
+    of each server are printed as soon as it responds, with an extra server
+    column, followed by a summary of the latency and any failure per server.
+    """
+    cnf = config.get_config()
+    servers = logged_in_servers(cnf)
+    if not servers:
+        raise exceptions.NotLoggedInException()
+    from stolos import aio
+
+    calls = [(host, list_func, (cnf["user"][host],)) for host in servers]
+    summary = []
+
+    def rows():
+        for result in aio.iter_completed(calls):
+            if result.error is not None:
+                status = "Failed: {}".format(result.error.format_message())
+            else:
+                status = "{} results".format(len(result.value))
+            summary.append(
+                (result.key, status, "{:.2f}s".format(result.elapsed), result.error)
+            )
+            for item in result.value or []:
+                yield (result.key,) + tuple(row_func(item))
+
+    echo_table(rows(), ["Server"] + headers)
+    click.echo("", err=True)
+    click.echo(
+        tabulate([row[:3] for row in summary], headers=["Server", "Status", "Latency"]),
+        err=True,
+    )
+    if any(row[3] is not None for row in summary):
+        ctx.exit(1)
@@ -0,0 +1,286 @@
+"""
+Commands for developing in the current Stolos project.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from stolos import bootstrap, config, journal, local, shell, ssh, tools, utils
+from stolos.logs import DEFAULT_RATE, SERVICES, Multiplexer
+from stolos.supervisor import Supervisor
+
+
+@click.command(help="Run all your services and sync your files")
+@click.option(
+    "-d",
+    "--detach",
+    default=False,
+    is_flag=True,
+    help="Sync files once and run services in the background.",
+)
+@click.option(
+    "--logs/--no-logs", default=True, help="Print/Do not print services logs."
+)
+@click.option(
+    "--build",
+    default=False,
+    is_flag=True,
+    help="Build service images before starting service containers.",
+)
+@click.option(
+    "--include",
+    multiple=True,
+    metavar="SOURCE",
+    help="Print only the output of sources matching this pattern, like 'web*'.",
+)
+@click.option(
+    "--exclude",
+    multiple=True,
+    metavar="SOURCE",
+    help="Do not print the output of sources matching this pattern, like 'sync'.",
+)
+@click.option(
+    "--rate-limit",
+    default=DEFAULT_RATE,
+    type=click.IntRange(0),
+    help="Maximum lines printed per second and source, or 0 for no limit.",
+)
+@click.option(
+    "--watch",
+    default=False,
+    is_flag=True,
+    help="Sync changed files as soon as they change, instead of rescanning.",
+)
+@click.option(
+    "--pipeline",
+    default=False,
+    is_flag=True,
+    help="Check Docker and prepare services that are not built while syncing.",
+)
+@click.pass_context
+def up(ctx, detach, logs, build, include, exclude, rate_limit, watch, pipeline):
+    utils.ensure_stolos_directory()
+    utils.ensure_logged_in()
+    cnf = config.get_config()
+    local.config_environ(cnf)
+    ctx.call_on_close(lambda: ssh.stop(cnf))
+    bootstrap.bootstrap(cnf)
+    click.echo("Syncing...")
+    if pipeline:
+        if not _pipelined_sync():
+            return
+    elif tools.sync_once(kind="up") != 0:
+        click.echo("There was an error with the sync")
+        return
+    bootstrap.mark_synced()
+    click.echo("Okay.")
+    click.echo("Starting services...")
+    compose_args = ["up", "-d", "--remove-orphans"]
+    if build:
+        compose_args.append("--build")
+    if tools.compose(compose_args).wait() != 0:
+        click.echo("There was an error with starting your services")
+        return
+    click.echo("Started services at {}".format(cnf["project"]["public-url"]))
+    if detach:
+        return
+    multiplexer = Multiplexer(include, exclude, rate_limit)
+    supervisor = Supervisor(multiplexer=multiplexer)
+    supervisor.add(
+        "Syncing",
+        lambda: tools.sync(True, capture=True, watch=watch),
+        restart=True,
+        source="sync",
+    )
+    if logs:
+        compose_args = ["logs", "--tail=20", "-f", "--no-color"]
+        supervisor.add(
+            "Services",
+            lambda: tools.compose(compose_args, capture=True),
+            source=SERVICES,
+        )
+    click.echo(supervisor.run())
+
+
+def _pipelined_sync():
+    """
+    Runs the initial sync of `up`, while checking the connection to Docker and
+    preparing the services that are not built from the synced files. Returns
+    True if all of them succeeded, except preparing services, which `up` does
+    again anyway.
+
+    The environment must already be configured, as Docker reads the
+    certificates written by `local.config_environ`.
+    """
+    with ThreadPoolExecutor(2) as executor:
+        docker_check = executor.submit(tools.check_docker)
+        preparation = executor.submit(tools.prepare_services)
+        synced = tools.sync_once(kind="up") == 0
+        docker_ok, docker_output = docker_check.result()
+        prepared, prepare_output = preparation.result()
+    if not synced:
+        click.echo("There was an error with the sync")
+        return False
+    if not docker_ok:
+        click.echo(docker_output)
+        click.echo(
+            "Could not connect to Docker at {}".format(os.environ["DOCKER_HOST"])
+        )
+        return False
+    if not prepared:
+        click.echo(prepare_output)
+        click.echo("There was an error preparing your services, retrying on start")
+    return True
+
+
+@click.command(
+    context_settings=dict(ignore_unknown_options=True, allow_extra_args=True),
+    help="Run Docker Compose commands in Stolos",
+)
+@click.pass_context
+def compose(ctx):
+    utils.ensure_stolos_directory()
+    cnf = config.get_config()
+    local.config_environ(cnf)
+    tools.compose(ctx.args).wait()
+
+
+@click.command(help="Sync your files, or only the given paths")
+@click.option(
+    "--repeat/--oneoff",
+    default=True,
+    help="If the sync should run continuously, defaults to true unless PATHS "
+    "are given",
+)
+@click.option(
+    "--watch",
+    default=False,
+    is_flag=True,
+    help="Sync changed files as soon as they change, instead of rescanning.",
+)
+@click.option(
+    "--changed",
+    default=False,
+    is_flag=True,
+    help="Sync once, only the local files changed since the last such sync.",
+)
+@click.option(
+    "--stats",
+    default=False,
+    is_flag=True,
+    help="Print the timings and transfers of a one-off sync.",
+)
+@click.argument("paths", nargs=-1, type=click.Path())
+@click.pass_context
+def sync(ctx, repeat, watch, changed, stats, paths):
+    if paths and (watch or changed):
+        raise click.UsageError("PATHS cannot be used with --watch or --changed")
+    if paths:
+        # Editors and build tools push the files they just touched, once.
+        repeat = False
+    if stats and repeat and not changed:
+        raise click.UsageError(
+            "--stats can only be used with --oneoff, --changed or PATHS"
+        )
+    # Paths are relative to the current directory, not to the project root.
+    paths = [os.path.abspath(path) for path in paths]
+    utils.ensure_stolos_directory()
+    paths = utils.get_project_paths(paths)
+    cnf = config.get_config()
+    local.config_environ(cnf)
+    if repeat and not changed:
+        # One-off syncs leave the control master to the next ones.
+        ctx.call_on_close(lambda: ssh.stop(cnf))
+    bootstrap.bootstrap(cnf)
+    if changed:
+        _sync_changed(stats)
+        return
+    click.echo("Syncing...")
+    if repeat:
+        tools.sync(repeat, watch=watch, paths=paths).wait()
+        return
+    kind = "paths" if paths else "oneoff"
+    if tools.sync_once(paths, kind=kind, show_stats=stats) == 0 and not paths:
+        bootstrap.mark_synced()
+    click.echo("Okay.")
+
+
+def _sync_changed(show_stats=False):
+    """
+    Syncs once the paths changed locally since the last successful sync, as
+    recorded in the journal of the project, or everything if there is no
+    journal yet. The journal is updated only if the sync succeeds.
+    """
+    previous = journal.load()
+    entries, paths = journal.scan(previous or {})
+    if previous is None or len(paths) > journal.MAX_PATHS:
+        paths = None
+    elif not paths:
+        click.echo("Nothing changed.")
+        return
+    click.echo("Syncing...")
+    paths = sorted(paths) if paths else None
+    if tools.sync_once(paths, kind="changed", show_stats=show_stats) != 0:
+        click.echo("There was an error with the sync")
+        return
+    bootstrap.mark_synced()
+    journal.save(entries)
+    click.echo("Okay.")
+
+
+@click.command(
+    name="open",
+    help="Open the public URL of the current project. Optionally provide service and port",
+)
+@click.argument("service", required=False)
+@click.argument("port", required=False)
+def launch(**kwargs):
+    utils.ensure_stolos_directory()
+    cnf = config.get_config()
+    public_url = utils.get_url_for_service_port(cnf, **kwargs)
+    click.echo("Opening http://{}...".format(public_url))
+    click.launch("http://{}".format(public_url))
+
+
+@click.command(help="Get information about your current project")
+def info(**kwargs):
+    from tabulate import tabulate
+
+    from stolos import api
+    from stolos.commands import common
+
+    utils.ensure_stolos_directory()
+    cnf = config.get_config()
+    stolos_url = cnf["user"]["default-api-server"]
+    utils.ensure_logged_in(stolos_url)
+    headers = ["UUID", "Stack", "Public URL"]
+    project = api.projects_retrieve(
+        cnf["user"][utils.get_hostname(stolos_url)], cnf["project"]["uuid"]
+    )
+    click.echo(tabulate([common.project_row(project)], headers=headers))
+
+
+@click.command(
+    help="Display the commands to set up the environment for the " "Docker client"
+)
+@click.option("--shell", help="Give the shell of your choice")
+def env(**kwargs):
+    utils.ensure_stolos_directory()
+    detected_shell = shell.detect()
+    if not kwargs["shell"] and not detected_shell:
+        click.echo("Shell could not be detected, falling back to bash", err=True)
+    # The output only depends on config and compose files, so it is rendered
+    # once and reused until any of them changes.
+    output = local.get_cached_env(kwargs["shell"], detected_shell)
+    if output is None:
+        cnf = config.get_config()
+        stolos_url = cnf["user"]["default-api-server"]
+        utils.ensure_logged_in(stolos_url)
+        env_dict = local.get_environ(cnf)
+        command = "stolos env"
+        if kwargs["shell"]:
+            command = "stolos env --shell={}".format(kwargs["shell"])
+        output = shell.render_env_eval(command, kwargs["shell"], env_dict)
+        local.store_cached_env(output, kwargs["shell"], detected_shell)
+    click.echo(output)
@@ -0,0 +1,147 @@
+"""
+Commands for managing the SSH public keys of Stolos users.
+"""
+import os
+import platform
+import re
+
+import click
+
+from stolos import api, config, exceptions, utils
+from stolos.commands import common
+
+
+@click.group(help="Manage your Stolos public keys")
+def keys():
+    pass
+
+
+@keys.command(help="Upload an SSH public key to Stolos")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option("--name", help="The name of this key, default to this machine's hostname")
+@click.argument(
+    "public_key_path", required=False, type=click.Path(), default="~/.ssh/id_rsa.pub"
+)
+def upload(**kwargs):
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    public_key_path = kwargs["public_key_path"]
+    if not public_key_path.endswith(".pub"):
+        click.confirm(
+            (
+                "Key {} appears to be a private, not a public key. "
+                "Are you sure you want to continue?"
+            ).format(
+                public_key_path
+            ),
+            abort=True,
+        )
+    expanded_public_key_path = os.path.expanduser(public_key_path)
+    if not os.path.exists(expanded_public_key_path):
+        raise click.exceptions.ClickException(
+            "File {} does not exist".format(public_key_path)
+        )
+
+    cnf = config.get_config()
+    stolos_url = kwargs.pop("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+
+    name = kwargs.get("name")
+    if not name:
+        name = platform.node()
+
+    with open(expanded_public_key_path, "r") as fin:
+        resp = api.keys_create(
+            cnf["user"][utils.get_hostname(stolos_url)],
+            ssh_public_key=fin.read(),
+            name=name,
+        )
+
+    updated_conf = cnf["user"][utils.get_hostname(stolos_url)]
+    updated_conf["identity-file"] = os.path.abspath(
+        re.sub(".pub$", "", expanded_public_key_path)
+    )
+    config.update_user_config({"user": {stolos_url: updated_conf}})
+    if resp.ok:
+        click.echo("Public key {} uploaded successfully".format(public_key_path))
+
+
+@keys.command(name="list", help="List your SSH public keys")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option(
+    "--md5/--sha256", default=True, help="The hasing algorithm to use, defaults to MD5"
+)
+@click.option(
+    "--all-servers",
+    default=False,
+    is_flag=True,
+    help="List from all the Stolos servers you are logged in, concurrently",
+)
+@click.pass_context
+def keys_list(ctx, **kwargs):
+    algorithm = "md5"
+    if not kwargs["md5"]:
+        algorithm = "sha256"
+    headers = ["UUID", "Name", algorithm.upper()]
+    if kwargs["all_servers"]:
+        common.echo_all_servers(
+            ctx,
+            api.keys_list,
+            lambda key: (key["uuid"], key["name"], key[algorithm]),
+            headers,
+        )
+        return
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    cnf = config.get_config()
+    stolos_url = kwargs.get("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    keys = (
+        (key["uuid"], key["name"], key[algorithm])
+        for key in api.keys_list(cnf["user"][utils.get_hostname(stolos_url)])
+    )
+    common.echo_table(keys, headers)
+
+
+@keys.command(help="Delete one or more SSH public keys")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option(
+    "--from-file",
+    type=click.File("r"),
+    help="Read the UUIDs of the keys to delete from a file, one per line",
+)
+@click.option(
+    "--parallel",
+    default=10,
+    type=click.IntRange(1, None),
+    help="How many keys to delete concurrently, defaults to 10",
+)
+@click.argument("public-key-uuids", nargs=-1)
+@click.pass_context
+def keys_delete(ctx, **kwargs):
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    public_key_uuids = list(kwargs.get("public_key_uuids"))
+    if kwargs["from_file"]:
+        public_key_uuids.extend(common.read_uuids(kwargs["from_file"]))
+    if not public_key_uuids:
+        raise exceptions.CLIRequiredException("public-key-uuid")
+    cnf = config.get_config()
+    stolos_url = kwargs.pop("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    credentials = cnf["user"][utils.get_hostname(stolos_url)]
+    if len(public_key_uuids) > 1 or kwargs["from_file"]:
+        common.bulk_delete(
+            ctx, api.keys_remove, credentials, public_key_uuids, kwargs["parallel"]
+        )
+        return
+    public_key_uuid = public_key_uuids[0]
+    click.echo('Deleting SSH public key "{}"...'.format(public_key_uuid), nl=False)
+    api.keys_remove(credentials, public_key_uuid)
+    click.echo("\t\tOkay.")
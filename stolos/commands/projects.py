@@ -0,0 +1,252 @@
+"""
+Commands for managing Stolos projects.
+"""
+import os
+import random
+import string
+
+import click
+
+from stolos import api, config, exceptions, local, tools, utils
+from stolos.commands import common
+
+
+@click.group(help="Manage your Stolos projects")
+def projects():
+    pass
+
+
+@projects.command(name="list", help="List your projects")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option(
+    "--all-servers",
+    default=False,
+    is_flag=True,
+    help="List from all the Stolos servers you are logged in, concurrently",
+)
+@click.pass_context
+def projects_list(ctx, **kwargs):
+    headers = ["UUID", "Stack", "Public URL"]
+    if kwargs["all_servers"]:
+        common.echo_all_servers(ctx, api.projects_list, common.project_row, headers)
+        return
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    cnf = config.get_config()
+    stolos_url = kwargs.get("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    projects = (
+        common.project_row(project)
+        for project in api.projects_list(cnf["user"][utils.get_hostname(stolos_url)])
+    )
+    common.echo_table(projects, headers)
+
+
+@projects.command(help="Create a new Stolos project")
+@click.option(
+    "--public-url", help="The public URL of your project, defaults to random hex"
+)
+@click.option(
+    "--subdomains/--no-subdomains",
+    default=False,
+    help="If this project should use subdomains for services, defaults to false",
+)
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option("--stack", help="The stack to use for this project, defaults to no stack")
+@click.option(
+    "--clone-workers",
+    default=tools.DEFAULT_CLONE_WORKERS,
+    type=click.IntRange(1),
+    help="How many service repositories to clone at once, where 1 lets clones "
+    "prompt for credentials",
+)
+@click.option(
+    "--shallow",
+    default=False,
+    is_flag=True,
+    help="Clone only the latest commit of Git service repositories",
+)
+@click.option(
+    "--partial",
+    default=False,
+    is_flag=True,
+    help="Clone Git service repositories without file contents, fetched on demand",
+)
+@click.argument("project_directory")
+def create(**kwargs):
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    cnf = config.get_config()
+    stolos_url = kwargs.pop("stolos_url")
+    project_directory = kwargs.pop("project_directory")
+    clone_options = _pop_clone_options(kwargs)
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    if not kwargs["public_url"]:
+        if kwargs["stack"]:
+            company, stack_name = kwargs["stack"].split("/")
+            fmt_str = "{company}-{stack_name}-{username}-{hex}.{server}"
+            kwargs["public_url"] = fmt_str.format(
+                company=company,
+                stack_name=stack_name,
+                username=cnf["user"][utils.get_hostname(stolos_url)]["username"],
+                hex="".join([random.choice(string.ascii_lowercase) for _ in range(6)]),
+                server=stolos_url,
+            )
+        else:
+            fmt_str = "{username}-{hex}.{server}"
+            kwargs["public_url"] = fmt_str.format(
+                username=cnf["user"][utils.get_hostname(stolos_url)]["username"],
+                hex="".join([random.choice(string.ascii_lowercase) for _ in range(6)]),
+                server=stolos_url,
+            )
+        click.echo('Assigning random public URL "{}"'.format(kwargs["public_url"]))
+    click.echo('Creating project "{}"...'.format(project_directory), nl=False)
+    project = api.projects_create(cnf["user"][utils.get_hostname(stolos_url)], **kwargs)
+    if not os.path.exists(project_directory):
+        os.makedirs(project_directory)
+    os.chdir(project_directory)
+    local.initialize_project(stolos_url, project)
+    click.echo("\t\tOk.")
+    tools.initialize_services(**clone_options)
+    if project_directory == ".":
+        click.echo('Your project is ready! Run "stolos up" to launch it!')
+        return
+    click.echo(
+        (
+            'Your project is ready! Change directory with "cd {0}" and run '
+            '"stolos up" to launch it!'
+        ).format(
+            project_directory
+        )
+    )
+
+
+def _pop_clone_options(kwargs):
+    """
+    Removes the options of service repository clones from the given command
+    arguments, returning them as arguments for `tools.initialize_services`.
+    """
+    return {
+        "workers": kwargs.pop("clone_workers"),
+        "shallow": kwargs.pop("shallow"),
+        "partial": kwargs.pop("partial"),
+    }
+
+
+@projects.command(help="Connect the current directory to an existing Stolos project")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option(
+    "--clone-workers",
+    default=tools.DEFAULT_CLONE_WORKERS,
+    type=click.IntRange(1),
+    help="How many service repositories to clone at once, where 1 lets clones "
+    "prompt for credentials",
+)
+@click.option(
+    "--shallow",
+    default=False,
+    is_flag=True,
+    help="Clone only the latest commit of Git service repositories",
+)
+@click.option(
+    "--partial",
+    default=False,
+    is_flag=True,
+    help="Clone Git service repositories without file contents, fetched on demand",
+)
+@click.argument("project_uuid")
+def connect(**kwargs):
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    cnf = config.get_config()
+    stolos_url = kwargs.pop("stolos_url")
+    project_uuid = kwargs.pop("project_uuid")
+    clone_options = _pop_clone_options(kwargs)
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    click.echo('Connecting to project "{}"...'.format(project_uuid), nl=False)
+    project = api.projects_retrieve(
+        cnf["user"][utils.get_hostname(stolos_url)], project_uuid
+    )
+    local.initialize_project(stolos_url, project)
+    tools.initialize_services(**clone_options)
+    click.echo("\t\tOkay.")
+    click.echo('Your project is ready! Run "stolos up" to launch it!')
+
+
+@projects.command(help="Delete one or more Stolos projects")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option(
+    "--from-file",
+    type=click.File("r"),
+    help="Read the UUIDs of the projects to delete from a file, one per line",
+)
+@click.option("--stack", help="Delete all your projects using the given stack")
+@click.option(
+    "--parallel",
+    default=10,
+    type=click.IntRange(1, None),
+    help="How many projects to delete concurrently, defaults to 10",
+)
+@click.option("--yes", default=False, is_flag=True, help="Do not ask for confirmation")
+@click.argument("project-uuids", nargs=-1)
+@click.pass_context
+def delete(ctx, **kwargs):
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    project_uuids = list(kwargs.pop("project_uuids"))
+    if kwargs["from_file"]:
+        project_uuids.extend(common.read_uuids(kwargs["from_file"]))
+    bulk = len(project_uuids) > 1 or kwargs["from_file"] or kwargs["stack"]
+    if (
+        not bulk
+        and not project_uuids
+        and not utils.ensure_stolos_directory(base_directory=None, raise_exc=False)
+    ):
+        raise exceptions.CLIRequiredException("project-uuid")
+    cnf = config.get_config()
+    stolos_url = kwargs.pop("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    credentials = cnf["user"][utils.get_hostname(stolos_url)]
+    if bulk:
+        if kwargs["stack"]:
+            matching = [
+                project["uuid"]
+                for project in api.projects_list(credentials)
+                if project["stack"] and project["stack"]["slug"] == kwargs["stack"]
+            ]
+            if matching and not kwargs["yes"]:
+                click.confirm(
+                    'Delete {} projects using stack "{}"?'.format(
+                        len(matching), kwargs["stack"]
+                    ),
+                    abort=True,
+                )
+            project_uuids.extend(matching)
+        common.bulk_delete(
+            ctx, api.projects_remove, credentials, project_uuids, kwargs["parallel"]
+        )
+        return
+    remove_directory = False
+    if not project_uuids:
+        project_uuid = cnf["project"]["uuid"]
+        remove_directory = True
+    else:
+        project_uuid = project_uuids[0]
+    click.echo('Deleting project "{}"...'.format(project_uuid), nl=False)
+    api.projects_remove(credentials, project_uuid)
+    click.echo("\t\tOkay.")
+    if remove_directory:
+        click.echo("Clearing up Docker resources...")
+        # Also, remove any leftover project resources.
+        local.config_environ(cnf)
+        tools.compose(["down"]).wait()
+        local.deinitialize_project()
+        click.echo("Okay.")
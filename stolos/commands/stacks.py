@@ -0,0 +1,40 @@
+"""
+Commands for managing Stolos stacks.
+"""
+import click
+
+from stolos import api, config, utils
+from stolos.commands import common
+
+
+@click.group(help="Manage your Stolos stacks")
+def stacks():
+    pass
+
+
+@stacks.command(name="list", help="List your stacks")
+@click.option(
+    "--stolos-url", help="The URL of the Stolos server to use, if not the default"
+)
+@click.option(
+    "--all-servers",
+    default=False,
+    is_flag=True,
+    help="List from all the Stolos servers you are logged in, concurrently",
+)
+@click.pass_context
+def stacks_list(ctx, **kwargs):
+    headers = ["Stack name", "Slug", "Description"]
+    if kwargs["all_servers"]:
+        common.echo_all_servers(ctx, api.stacks_list, common.stack_row, headers)
+        return
+    utils.ensure_logged_in(kwargs["stolos_url"])
+    cnf = config.get_config()
+    stolos_url = kwargs.get("stolos_url")
+    if not stolos_url:
+        stolos_url = cnf["user"]["default-api-server"]
+    stacks = (
+        common.stack_row(stack)
+        for stack in api.stacks_list(cnf["user"][utils.get_hostname(stolos_url)])
+    )
+    common.echo_table(stacks, headers)
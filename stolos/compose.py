@@ -0,0 +1,192 @@
+"""
+Model of the Docker Compose file of a Stolos project. Each file is parsed once
+per process, and the parsed model is also cached on disk by content hash, so
+that unchanged compose files are never parsed again.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from six import iteritems
+
+
+# Candidate compose files of a project, in order of preference.
+COMPOSE_FILES = [".stolos.yml", "docker-compose.yaml", "docker-compose.yml"]
+
+# How many parsed compose files to keep in the on-disk cache of a project.
+DISK_CACHE_SIZE = 4
+
+# Environment variables in list form, like `KEY=value`.
+ENV_VAR = re.compile(r"^([^=]+)=(.+)")
+
+# Parsed compose files of this process, keyed by path and mapped to a
+# `(stamp, ComposeFile)` tuple.
+_files = {}
+
+
+class Service(object):
+    """
+    A service of a compose file, with its environment normalized to a dict.
+    The ports are None if the service does not publish any.
+    """
+
+    def __init__(self, name, ports=None, environment=None, build=False):
+        self.name = name
+        self.ports = ports
+        self.environment = environment or {}
+        self.build = build
+
+    @classmethod
+    def from_details(cls, name, details):
+        """
+        Creates a service from its details, as found in a compose file.
+        """
+        details = details or {}
+        environment = details.get("environment") or {}
+        if type(environment) == list:
+            variables = environment
+            environment = {}
+            for var in variables:
+                match = ENV_VAR.match(var)
+                if match is None:
+                    continue
+                environment[match.group(1)] = match.group(2)
+        return cls(
+            name,
+            ports=details.get("ports"),
+            environment=environment,
+            build="build" in details,
+        )
+
+    @property
+    def repo_url(self):
+        """
+        The `STOLOS_REPO_URL` of the service, or None.
+        """
+        return self.environment.get("STOLOS_REPO_URL")
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "ports": self.ports,
+            "environment": self.environment,
+            "build": self.build,
+        }
+
+
+class ComposeFile(object):
+    """
+    The services of a compose file, in the order they are defined.
+    """
+
+    def __init__(self, path, services):
+        self.path = path
+        self.services = services
+
+    @property
+    def repo_urls(self):
+        """
+        The `STOLOS_REPO_URL` of each service that has one, keyed by service.
+        """
+        return {
+            service.name: service.repo_url
+            for service in self.services
+            if service.repo_url is not None
+        }
+
+    def to_dict(self):
+        return {"services": [service.to_dict() for service in self.services]}
+
+    @classmethod
+    def from_dict(cls, path, data):
+        return cls(
+            path,
+            [
+                Service(
+                    service["name"],
+                    ports=service["ports"],
+                    environment=service["environment"],
+                    build=service["build"],
+                )
+                for service in data["services"]
+            ],
+        )
+
+
+def find(directory=None):
+    """
+    Returns the path of the compose file of the project in the given directory,
+    defaulting to the current one. If none exists, the path of the last
+    candidate is returned.
+    """
+    directory = directory or os.getcwd()
+    for filename in COMPOSE_FILES:
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            break
+    return path
+
+
+def load(path):
+    """
+    Returns the `ComposeFile` at the given path, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    stamp = (stat.st_mtime, stat.st_size)
+    cached = _files.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, _load(path))
+        _files[path] = cached
+    return cached[1]
+
+
+def _load(path):
+    """
+    Parses the compose file at the given path, unless its contents are found in
+    the on-disk cache of the project.
+    """
+    with open(path, "rb") as fin:
+        contents = fin.read()
+    digest = hashlib.sha1(contents).hexdigest()
+    cache_path = os.path.join(os.path.dirname(path), ".stolos", "compose-cache.json")
+    try:
+        with open(cache_path, "r") as fin:
+            entries = json.load(fin)
+    except (IOError, OSError, ValueError):
+        entries = []
+    for entry_digest, data in entries:
+        if entry_digest == digest:
+            return ComposeFile.from_dict(path, data)
+    compose_file = _parse(path, contents)
+    # The cache lives in the `.stolos` directory, so only initialized projects
+    # are cached.
+    directory = os.path.dirname(cache_path)
+    if os.path.isdir(directory):
+        entries = [[digest, compose_file.to_dict()]] + entries
+        try:
+            data = json.dumps(entries[:DISK_CACHE_SIZE])
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as fout:
+                fout.write(data)
+            os.replace(tmp_path, cache_path)
+        except (IOError, OSError, TypeError, ValueError):
+            pass
+    return compose_file
+
+
+def _parse(path, contents):
+    # YAML is imported lazily, as parsed files are usually cached.
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    data = yaml.load(contents, Loader=loader) or {}
+    services = [
+        Service.from_details(name, details)
+        for name, details in iteritems(data.get("services") or {})
+    ]
+    return ComposeFile(path, services)
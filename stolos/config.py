@@ -1,7 +1,39 @@
+import copy
+import errno
+import hashlib
+import json
 import os
+import tempfile
+import time
+from contextlib import contextmanager
 
 import click
-import yaml
+
+from stolos import exceptions
+
+
+# Parsed configuration files of this process, keyed by path and mapped to a
+# `(stamp, config)` tuple, where `stamp` identifies the parsed file version.
+_files = {}
+
+# The last merged configuration, as a `(stamps, config)` tuple.
+_merged = None
+
+# Version of the on-disk snapshot format, bumped on incompatible changes.
+SNAPSHOT_VERSION = 1
+
+# Most snapshots kept in the user directory, dropping the least recently used
+# ones beyond that.
+MAX_SNAPSHOTS = 32
+
+# Updates queued by the active transaction, keyed by config path, or None when
+# no transaction is active.
+_pending = None
+
+# Seconds to wait for the lock of a config file, and after which an existing
+# lock is considered abandoned by a crashed process.
+LOCK_TIMEOUT = 10
+STALE_LOCK_TIMEOUT = 30
 
 
 def get_user_config():
@@ -9,16 +41,14 @@ def get_user_config():
     Returns the user configuration, taking into account only the user
     directory.
     """
-    config = os.path.join(click.get_app_dir("Stolos"), "config.yaml")
-    return _get_config(config)
+    return copy.deepcopy(_load(_user_config_path()))
 
 
 def get_project_config():
     """
     Returns the current project config.
     """
-    config = os.path.join(os.getcwd(), ".stolos", "config.yaml")
-    return _get_config(config)
+    return copy.deepcopy(_load(_project_config_path()))
 
 
 def get_config():
@@ -26,51 +56,299 @@ def get_config():
     Returns the merged configuration, from the current directory and the user
     directory.
     """
-    config = get_user_config()
-    update = get_project_config()
-    for key in update:
-        if key in config and type(config[key]) == dict:
-            config[key].update(update[key])
-        else:
-            config[key] = update[key]
-    return config
+    global _merged
+    user_path = _user_config_path()
+    project_path = _project_config_path()
+    stamps = (user_path, _stamp(user_path), project_path, _stamp(project_path))
+    if _pending:
+        # Queued updates are not on disk yet, so skip memoized configs.
+        return _merge(copy.deepcopy(_load(user_path)), _load(project_path))
+    if _merged is None or _merged[0] != stamps:
+        # Only projects are snapshotted, not every directory the CLI runs in.
+        is_project = stamps[3] is not None
+        config = _load_snapshot(project_path, stamps) if is_project else None
+        if config is None:
+            config = _merge(copy.deepcopy(_load(user_path)), _load(project_path))
+            if is_project:
+                _store_snapshot(project_path, stamps, config)
+        _merged = (stamps, config)
+    return copy.deepcopy(_merged[1])
 
 
 def update_user_config(update):
     """
     Updates the user configuration with the given parameters.
     """
-    config = os.path.join(click.get_app_dir("Stolos"), "config.yaml")
-    _update_config(config, update)
+    _update_config(_user_config_path(), update)
 
 
 def update_project_config(update):
     """
     Updates the project configuration with the given parameters.
     """
-    config = os.path.join(os.getcwd(), ".stolos", "config.yaml")
-    _update_config(config, update)
+    _update_config(_project_config_path(), update)
 
 
-def _get_config(path):
+@contextmanager
+def transaction():
     """
-    Returns the config from the given file, if exists.
+    Batches all the config updates made within the block, writing each config
+    file once when the block exits. Reads within the block already reflect the
+    queued updates. Updates queued before an exception are still written.
+
+    Nested transactions are merged into the outermost one.
     """
-    if os.path.isfile(path):
+    global _pending
+    if _pending is not None:
+        yield
+        return
+    _pending = {}
+    try:
+        yield
+    finally:
+        pending, _pending = _pending, None
+        for path, updates in pending.items():
+            _write_config(path, updates)
+        invalidate()
+
+
+def get_config_paths():
+    """
+    Returns the paths of the user and the project configuration files.
+    """
+    return _user_config_path(), _project_config_path()
+
+
+def invalidate():
+    """
+    Drops all the configuration parsed by this process, along with the
+    snapshot of the current directory, so that it is read again from disk on
+    next access.
+    """
+    global _merged
+    _files.clear()
+    _merged = None
+    try:
+        os.remove(_snapshot_path(_project_config_path()))
+    except OSError:
+        pass
+
+
+def _user_config_path():
+    return os.path.join(click.get_app_dir("Stolos"), "config.yaml")
+
+
+def _project_config_path():
+    return os.path.join(os.getcwd(), ".stolos", "config.yaml")
+
+
+def _stamp(path):
+    """
+    Returns the modification time and size of the given file, or None if it
+    does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def _snapshot_path(project_path):
+    """
+    Returns the path of the merged config snapshot for the given project
+    config. Snapshots are kept in the user directory, next to the user config.
+    """
+    key = hashlib.sha1(project_path.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(click.get_app_dir("Stolos"), "snapshots", key + ".json")
+
+
+def _load_snapshot(project_path, stamps):
+    """
+    Returns the merged config from the snapshot of the given project config,
+    or None if there is no snapshot or it is older than the config files.
+    """
+    path = _snapshot_path(project_path)
+    try:
         with open(path, "r") as fin:
-            return yaml.load(fin)
-    return {}
+            snapshot = json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if snapshot.get("stamps") != json.loads(json.dumps(stamps)):
+        return None
+    try:
+        # Marks the snapshot as recently used, for `_prune_snapshots`.
+        os.utime(path)
+    except OSError:
+        pass
+    return snapshot.get("config")
 
 
-def _update_config(path, update):
-    config = _get_config(path)
+def _store_snapshot(project_path, stamps, config):
+    """
+    Stores the given merged config as the snapshot of the given project
+    config, so that following invocations can skip parsing YAML.
+    """
+    path = _snapshot_path(project_path)
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as fout:
+            json.dump(
+                {"version": SNAPSHOT_VERSION, "stamps": stamps, "config": config}, fout
+            )
+        os.replace(tmp_path, path)
+    except (IOError, OSError, TypeError, ValueError):
+        # Configs that cannot be stored as JSON are simply not snapshotted.
+        os.remove(tmp_path)
+        return
+    _prune_snapshots(directory)
+
+
+def _prune_snapshots(directory):
+    """
+    Removes the least recently used snapshots in the given directory, beyond
+    `MAX_SNAPSHOTS`, as each one holds a copy of the credentials.
+    """
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(directory)
+            if entry.name.endswith(".json") and entry.is_file()
+        ]
+        if len(entries) <= MAX_SNAPSHOTS:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for entry in entries[MAX_SNAPSHOTS:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _load(path):
+    """
+    Returns the config from the given file, parsing it only if it changed
+    since it was last parsed, along with any updates queued by the active
+    transaction. The returned dict must not be modified.
+    """
+    stamp = _stamp(path)
+    config = {}
+    if stamp is not None:
+        cached = _files.get(path)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, _get_config(path))
+            _files[path] = cached
+        config = cached[1]
+    if _pending and path in _pending:
+        config = copy.deepcopy(config)
+        for update in _pending[path]:
+            _merge(config, update)
+    return config
+
+
+def _merge(config, update):
+    """
+    Merges the given update into the given config, one level deep, and returns
+    the config.
+    """
     for key in update:
         if key in config and type(config[key]) == dict:
             config[key].update(update[key])
         else:
             config[key] = update[key]
+    return config
+
+
+def _get_config(path):
+    """
+    Returns the config from the given file, if exists.
+    """
+    if os.path.isfile(path):
+        # YAML is imported lazily, as most invocations use the snapshot.
+        import yaml
+
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        with open(path, "r") as fin:
+            return yaml.load(fin, Loader=loader) or {}
+    return {}
+
+
+def _update_config(path, update):
+    if _pending is not None:
+        _pending.setdefault(path, []).append(copy.deepcopy(update))
+        return
+    _write_config(path, [update])
+    invalidate()
+
+
+def _write_config(path, updates):
+    """
+    Applies the given updates to the given config file, atomically. The file
+    is locked while being updated, so that concurrent CLI processes do not
+    lose each other's updates, and replaced by a complete temporary file, so
+    that it is never left truncated.
+    """
+    import yaml
+
     parent_dir = os.path.abspath(os.path.join(path, os.pardir))
     if not os.path.isdir(parent_dir):
         os.makedirs(parent_dir)
-    with open(path, "w+") as fout:
-        yaml.safe_dump(config, stream=fout, default_flow_style=False, indent=2)
+    with _lock(path):
+        config = _get_config(path)
+        for update in updates:
+            _merge(config, update)
+        fd, tmp_path = tempfile.mkstemp(dir=parent_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fout:
+                yaml.safe_dump(config, stream=fout, default_flow_style=False, indent=2)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+@contextmanager
+def _lock(path):
+    """
+    Holds an exclusive lock file next to the given config file. Locks older
+    than `STALE_LOCK_TIMEOUT` are considered abandoned and taken over.
+    """
+    lock_path = path + ".lock"
+    deadline = time.time() + LOCK_TIMEOUT
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            break
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > STALE_LOCK_TIMEOUT:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise exceptions.ConfigLockedException(lock_path)
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
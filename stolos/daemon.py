@@ -0,0 +1,374 @@
+"""
+Resident Stolos agent. `stolosd` keeps the CLI loaded in a long-lived process,
+along with its warm state, like parsed configuration and pooled connections to
+Stolos servers. `stolos` commands that are safe to run remotely are forwarded
+to it over a unix domain socket, when it is running.
+
+Each command runs on its own thread, so that a slow command does not hold up
+the rest. Their standard streams and environment are per thread, and so is
+their working directory where the platform allows it, while elsewhere commands
+take turns.
+
+This module is imported on every `stolos` invocation, so it must stay light.
+"""
+import collections.abc
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+
+import click
+
+
+# Commands that can be forwarded to the agent, as prefixes of the arguments.
+# Only non-interactive commands that do not spawn processes are forwarded.
+FORWARDED_COMMANDS = [
+    ("version",),
+    ("env",),
+    ("info",),
+    ("stacks", "list"),
+    ("projects", "list"),
+    ("keys", "list"),
+]
+
+# Options of the root group that may precede a forwarded command.
+GLOBAL_OPTIONS = ["--no-cache"]
+
+# Seconds to wait for the agent to accept a connection.
+CONNECT_TIMEOUT = 0.5
+
+# Seconds to wait for the first output of a command run by the agent, before
+# running it in this process instead.
+RESPONSE_TIMEOUT = 5
+
+# Seconds the agent waits for a client to send its request.
+REQUEST_TIMEOUT = 5
+
+# Flag of `unshare` giving the calling thread its own working directory, from
+# `sched.h`.
+CLONE_FS = 0x200
+
+# State of the command run by the current thread of the agent, and the lock
+# commands take turns with, when they cannot have their own working directory.
+_local = threading.local()
+_cwd_lock = threading.Lock()
+
+
+def socket_path():
+    """
+    Returns the path of the agent socket, in the user application directory,
+    unless overridden by `STOLOSD_SOCKET`.
+    """
+    if "STOLOSD_SOCKET" in os.environ:
+        return os.environ["STOLOSD_SOCKET"]
+    return os.path.join(click.get_app_dir("Stolos"), "stolosd.sock")
+
+
+def is_forwardable(args):
+    """
+    Returns True if the given `stolos` arguments can be run by the agent.
+    """
+    args = [arg for arg in args if arg not in GLOBAL_OPTIONS]
+    for command in FORWARDED_COMMANDS:
+        if tuple(args[: len(command)]) == command:
+            return True
+    return False
+
+
+def forward(args):
+    """
+    Runs the given `stolos` arguments through the agent, streaming its output,
+    and returns the exit code. Returns None if the command should run in this
+    process instead, because it cannot be forwarded or the agent is not
+    running.
+    """
+    if not hasattr(socket, "AF_UNIX") or os.environ.get("STOLOS_NO_DAEMON"):
+        return None
+    if not is_forwardable(args):
+        return None
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except (OSError, socket.error):
+        sock.close()
+        return None
+    sock.settimeout(RESPONSE_TIMEOUT)
+    request = {
+        "args": args,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+        "tty": {"stdout": sys.stdout.isatty(), "stderr": sys.stderr.isatty()},
+    }
+    received = False
+    try:
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        for line in sock.makefile("r"):
+            message = json.loads(line)
+            if not received:
+                # Once started, commands may take as long as they need.
+                sock.settimeout(None)
+            received = True
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if message["stream"] == "stdout" else sys.stderr
+            stream.write(message["data"])
+            stream.flush()
+    except (OSError, socket.error, ValueError):
+        pass
+    finally:
+        sock.close()
+    if not received:
+        return None
+    sys.stderr.write("Lost connection to stolosd.\n")
+    return 1
+
+
+class _SocketStream(object):
+    """
+    Text stream sending everything written to it to an agent client. Streams
+    of the same client share a lock, as the threads of a command may write to
+    them concurrently.
+    """
+
+    encoding = "utf-8"
+    errors = "replace"
+
+    def __init__(self, sock, name, tty, lock):
+        self.sock = sock
+        self.name = name
+        self.tty = tty
+        self.lock = lock
+
+    def write(self, data):
+        if not isinstance(data, str):
+            # Like other text streams, so that click writes text to it.
+            raise TypeError("write() argument must be str")
+        if data:
+            message = {"stream": self.name, "data": data}
+            with self.lock:
+                self.sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+
+class _ThreadStream(object):
+    """
+    Standard stream of the agent, writing to the stream of the command run by
+    the current thread, if any.
+    """
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def _target(self):
+        state = getattr(_local, "state", None)
+        return self.default if state is None else state[self.name]
+
+    def write(self, data):
+        return self._target().write(data)
+
+    def flush(self):
+        return self._target().flush()
+
+    def isatty(self):
+        return self._target().isatty()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class _ThreadEnviron(collections.abc.MutableMapping):
+    """
+    Environment of the agent, replaced by the environment of the command run
+    by the current thread, if any.
+    """
+
+    def __init__(self, default):
+        self.default = default
+
+    def _target(self):
+        state = getattr(_local, "state", None)
+        return self.default if state is None else state["environ"]
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __iter__(self):
+        return iter(list(self._target()))
+
+    def __len__(self):
+        return len(self._target())
+
+    def copy(self):
+        return dict(self._target())
+
+
+def bind(func):
+    """
+    Returns the given function, running as part of the agent command of the
+    current thread, if any, for use on the worker threads of the command.
+    """
+    state = getattr(_local, "state", None)
+    if state is None:
+        return func
+
+    def run(*args, **kwargs):
+        _local.state = state
+        try:
+            return func(*args, **kwargs)
+        finally:
+            del _local.state
+
+    return run
+
+
+def _isolate_cwd():
+    """
+    Gives the current thread, and the threads it starts, their own working
+    directory, on Linux. Returns False where that is not supported.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    import ctypes
+
+    try:
+        return ctypes.CDLL(None, use_errno=True).unshare(CLONE_FS) == 0
+    except (AttributeError, OSError):
+        return False
+
+
+def _handle(sock, cli):
+    """
+    Runs the command requested by the client of the given socket, on the
+    current thread, with its own streams, environment and working directory.
+    """
+    from stolos import api
+
+    sock.settimeout(REQUEST_TIMEOUT)
+    request = json.loads(sock.makefile("r").readline())
+    sock.settimeout(None)
+    if not is_forwardable(request["args"]):
+        raise ValueError("Command cannot be forwarded")
+    lock = threading.Lock()
+    _local.state = {
+        "stdout": _SocketStream(sock, "stdout", request["tty"]["stdout"], lock),
+        "stderr": _SocketStream(sock, "stderr", request["tty"]["stderr"], lock),
+        "environ": dict(request["env"]),
+    }
+    isolated = _isolate_cwd()
+    if not isolated:
+        _cwd_lock.acquire()
+        cwd = os.getcwd()
+    exit_code = 0
+    try:
+        os.chdir(request["cwd"])
+        api.reset_retries()
+        cli.main(args=request["args"], prog_name="stolos")
+    except SystemExit as exc:
+        if exc.code is None:
+            exit_code = 0
+        elif isinstance(exc.code, int):
+            exit_code = exc.code
+        else:
+            sys.stderr.write("{}\n".format(exc.code))
+            exit_code = 1
+    except Exception as exc:
+        sys.stderr.write("stolosd: {}\n".format(exc))
+        exit_code = 1
+    finally:
+        del _local.state
+        if not isolated:
+            os.chdir(cwd)
+            _cwd_lock.release()
+    sock.sendall((json.dumps({"exit": exit_code}) + "\n").encode("utf-8"))
+
+
+def serve(path):
+    """
+    Serves `stolos` commands on the unix domain socket at the given path, each
+    on its own thread, until interrupted.
+    """
+    from stolos.cli import cli
+
+    # Load all the commands up front, so that requests do not pay for imports.
+    for name in cli.list_commands(None):
+        cli.get_command(None, name)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (OSError, socket.error):
+            os.remove(path)
+        else:
+            raise RuntimeError("stolosd is already running at {}".format(path))
+        finally:
+            probe.close()
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    sys.stdout = _ThreadStream("stdout", sys.stdout)
+    sys.stderr = _ThreadStream("stderr", sys.stderr)
+    os.environ = _ThreadEnviron(os.environ)
+    try:
+        while True:
+            conn, _ = server.accept()
+            thread = threading.Thread(target=_serve_connection, args=(conn, cli))
+            thread.daemon = True
+            thread.start()
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def _serve_connection(conn, cli):
+    try:
+        _handle(conn, cli)
+    except (OSError, socket.error, ValueError, KeyError):
+        pass
+    finally:
+        conn.close()
+
+
+def _terminate(*args):
+    raise KeyboardInterrupt()
+
+
+@click.command(help="Run the resident Stolos agent")
+@click.option("--socket", "path", help="The path of the socket to listen on")
+def main(path):
+    path = path or socket_path()
+    if not hasattr(socket, "AF_UNIX"):
+        raise click.ClickException("stolosd is not supported on this platform")
+    click.echo("Listening on {}".format(path), err=True)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        serve(path)
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
@@ -53,7 +53,7 @@ class BadRequest(ClickException):
 
 class Timeout(ClickException):
     def __init__(self):
-        super(Timeout, "Request timed out")
+        super(Timeout, self).__init__("Request timed out")
 
 
 class ResourceDoesNotExist(ClickException):
@@ -73,3 +73,18 @@ class NotLoggedInException(ClickException):
 class ResourceAlreadyExists(ClickException):
     def __init__(self):
         super(ResourceAlreadyExists, self).__init__("Resource already exists.")
+
+
+class ConfigLockedException(ClickException):
+    def __init__(self, lock_path):
+        super(ConfigLockedException, self).__init__(
+            "Configuration is locked by another Stolos process. "
+            "If no other process is running, remove {}".format(lock_path)
+        )
+
+
+class PathOutsideProjectException(ClickException):
+    def __init__(self, path):
+        super(PathOutsideProjectException, self).__init__(
+            'Path "{}" is not inside the Stolos project.'.format(path)
+        )
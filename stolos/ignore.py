@@ -0,0 +1,255 @@
+"""
+Ignore rules of a project, compiled from its `.gitignore`, `.dockerignore` and
+`.stolosignore` files. The rules are written as Unison `ignore` and `ignorenot`
+preferences to `.stolos/ignore`, included by the Unison profile, and are also
+available as a matcher, for the parts of the CLI walking the project
+themselves.
+
+Only the files at the root of the project are read. `.gitignore` and
+`.stolosignore` follow Git semantics, where patterns without a slash match at
+any depth, while `.dockerignore` patterns are always relative to the root.
+Patterns matching only directories, with a trailing slash, also match files
+with the same name in Unison, which cannot tell them apart. Negated patterns
+follow Unison semantics instead of Git's: like `ignorenot` preferences, they
+override every other pattern, wherever they appear, so that `!.env.example`
+in `.gitignore` keeps that file synced despite `.env*` in `.dockerignore`.
+"""
+import hashlib
+import os
+import re
+
+
+# Ignore files of a project, mapped to whether their patterns are anchored to
+# the root of the project, like in `.dockerignore`.
+SOURCES = [(".gitignore", False), (".dockerignore", True), (".stolosignore", False)]
+
+# Rules applied before those of the ignore files, as `(negated, pattern,
+# anchored, directory_only)` tuples. Negated patterns in the ignore files can
+# still override them, like `!.git` to sync Git repositories.
+DEFAULT_RULES = [(False, ".git", False, False)]
+
+# Path of the compiled Unison rules, relative to the project root.
+IGNORE_PROFILE = ".stolos/ignore"
+
+# Path of the Unison profile including the compiled rules.
+COMMON_PROFILE = ".stolos/common"
+
+# Line of the Unison profile including the compiled rules.
+INCLUDE_LINE = "include ignore"
+
+
+class Rule(object):
+    """
+    A single ignore pattern, matching paths relative to the project root, with
+    forward slashes.
+    """
+
+    def __init__(self, negated, pattern, anchored, directory_only):
+        self.negated = negated
+        self.pattern = pattern
+        self.anchored = anchored
+        self.directory_only = directory_only
+        self.regex = re.compile("^{}$".format(_translate(pattern)))
+
+    def matches(self, path, is_dir):
+        if self.directory_only and not is_dir:
+            return False
+        if not self.anchored:
+            path = path.rsplit("/", 1)[-1]
+        return self.regex.match(path) is not None
+
+    def to_unison(self):
+        """
+        Returns the rule as a Unison `ignore` or `ignorenot` preference.
+        """
+        preference = "ignorenot" if self.negated else "ignore"
+        if "**" in self.pattern:
+            # Unison globs cannot match across directories.
+            regex = _translate(self.pattern)
+            if not self.anchored:
+                regex = "(.*/)?" + regex
+            return "{} = Regex {}".format(preference, regex)
+        kind = "Path" if self.anchored else "Name"
+        pattern = re.sub(r"([{},])", r"\\\1", self.pattern)
+        return "{} = {} {}".format(preference, kind, pattern)
+
+
+class Matcher(object):
+    """
+    Tells whether paths of the project are ignored, like Unison would with the
+    compiled rules, where paths are ignored if they match any `ignore` rule
+    and no `ignorenot` one. `.stolos` is always ignored.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def matches(self, path, is_dir=False):
+        """
+        Returns True if the rules ignore the given path, relative to the
+        project root, regardless of its parent directories. Walks pruning
+        ignored directories only need this.
+        """
+        path = path.replace(os.sep, "/").strip("/")
+        if path == ".stolos":
+            return True
+        ignored = False
+        for rule in self.rules:
+            if rule.matches(path, is_dir):
+                if rule.negated:
+                    return False
+                ignored = True
+        return ignored
+
+    def is_ignored(self, path, is_dir=False):
+        """
+        Returns True if the given path, relative to the project root, is
+        ignored, either itself or as part of an ignored directory.
+        """
+        parts = path.replace(os.sep, "/").strip("/").split("/")
+        for index in range(1, len(parts) + 1):
+            prefix = "/".join(parts[:index])
+            if self.matches(prefix, is_dir or index < len(parts)):
+                return True
+        return False
+
+
+def _translate(pattern):
+    """
+    Translates a Git style glob into a regular expression, valid in both Python
+    and Unison, where `*` and `?` do not match slashes, while `**` does.
+    """
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            regex += "(.*/)?"
+            index += 3
+            continue
+        if pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+            continue
+        if char == "*":
+            regex += "[^/]*"
+        elif char == "?":
+            regex += "[^/]"
+        elif char == "[":
+            end = pattern.find("]", index + 2)
+            if end < 0:
+                regex += re.escape(char)
+            else:
+                content = pattern[index + 1 : end]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                regex += "[{}]".format(content.replace("\\", "\\\\"))
+                index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            regex += re.escape(pattern[index])
+        else:
+            regex += re.escape(char)
+        index += 1
+    return regex
+
+
+def parse(lines, anchored=False):
+    """
+    Returns the rules of the given lines of an ignore file, where `anchored`
+    makes all the patterns relative to the root of the project.
+    """
+    rules = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith("#"):
+            continue
+        if not line.endswith("\\ "):
+            line = line.rstrip()
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        if anchored:
+            # Docker cleans the patterns of `.dockerignore`, like `./build`.
+            while line.startswith("./"):
+                line = line[2:].lstrip("/")
+        directory_only = line.endswith("/")
+        line = line.rstrip("/")
+        # Patterns with a leading or middle slash are relative to the root.
+        rule_anchored = anchored or "/" in line
+        line = line.lstrip("/")
+        if line.startswith("**/") and "/" not in line[3:]:
+            line, rule_anchored = line[3:], False
+        if line:
+            rules.append(Rule(negated, line, rule_anchored, directory_only))
+    return rules
+
+
+def _read_sources(directory):
+    """
+    Returns the contents of the ignore files of the project, in order, with
+    None for the missing ones.
+    """
+    contents = []
+    for filename, _ in SOURCES:
+        try:
+            with open(os.path.join(directory, filename), "r") as fin:
+                contents.append(fin.read())
+        except (IOError, OSError):
+            contents.append(None)
+    return contents
+
+
+def load(directory=os.curdir):
+    """
+    Returns the `Matcher` of the project in the given directory.
+    """
+    rules = [Rule(*rule) for rule in DEFAULT_RULES]
+    for (_, anchored), content in zip(SOURCES, _read_sources(directory)):
+        if content is not None:
+            rules.extend(parse(content.splitlines(), anchored))
+    return Matcher(rules)
+
+
+def fingerprint(directory=os.curdir):
+    """
+    Returns a digest of the ignore rules of the project in the given directory,
+    which changes whenever its ignore files do.
+    """
+    contents = _read_sources(directory)
+    return hashlib.sha1(repr([DEFAULT_RULES, contents]).encode("utf-8")).hexdigest()
+
+
+def update(directory=os.curdir):
+    """
+    Compiles the ignore rules of the project in the given directory to Unison
+    preferences, unless its ignore files did not change since they were last
+    compiled. Also makes sure the Unison profile of the project includes them,
+    as it does not in projects initialized by earlier versions.
+    """
+    header = "# Compiled by the Stolos CLI from ignore files: {}\n".format(
+        fingerprint(directory)
+    )
+    profile_path = os.path.join(directory, IGNORE_PROFILE)
+    try:
+        with open(profile_path, "r") as fin:
+            up_to_date = fin.readline() == header
+    except (IOError, OSError):
+        up_to_date = False
+    if not up_to_date:
+        matcher = load(directory)
+        with open(profile_path, "w") as fout:
+            fout.write(header)
+            for rule in matcher.rules:
+                fout.write(rule.to_unison() + "\n")
+    common_path = os.path.join(directory, COMMON_PROFILE)
+    try:
+        with open(common_path, "r") as fin:
+            included = INCLUDE_LINE in fin.read().splitlines()
+    except (IOError, OSError):
+        return
+    if not included:
+        with open(common_path, "a") as fout:
+            fout.write("\n{}\n".format(INCLUDE_LINE))
@@ -0,0 +1,187 @@
+"""
+Journal of the local files of a project, as of their last successful sync. A
+walk of the project compares each file against the journal, and only the
+changed paths are handed to Unison, which otherwise scans the whole tree on
+both sides on every sync.
+
+The journal only knows about local changes, so syncs of changed paths do not
+pick up changes made on the remote side.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from stat import S_ISDIR, S_ISREG
+
+from stolos import ignore
+
+
+# Path of the journal, relative to the project root.
+JOURNAL = ".stolos/journal.json"
+
+# Version of the journal format, changed whenever it becomes incompatible.
+JOURNAL_VERSION = 1
+
+# Most changed paths synced with `-path`, before syncing everything instead.
+MAX_PATHS = 256
+
+# Files modified this close to a scan, in nanoseconds, may be modified again
+# without their modification time changing, as timestamps are coarse. They are
+# checked again on the next scan.
+RACY_WINDOW = 2 * 10**9
+
+# Largest file hashed to tell actual changes from touched files, in bytes.
+MAX_HASH_SIZE = 1024 * 1024
+
+
+def load():
+    """
+    Returns the entries of the journal of the current project, mapping paths
+    to `[size, mtime_ns, inode, hash]` lists, or None if there is none.
+    """
+    try:
+        with open(JOURNAL, "r") as fin:
+            journal = json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
+    if journal.get("version") != JOURNAL_VERSION:
+        return None
+    return journal["files"]
+
+
+def save(entries):
+    """
+    Replaces the journal of the current project with the given entries.
+    """
+    directory = os.path.dirname(JOURNAL)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fout:
+            json.dump({"version": JOURNAL_VERSION, "files": entries}, fout)
+        os.replace(tmp_path, JOURNAL)
+    except (IOError, OSError):
+        os.remove(tmp_path)
+        raise
+
+
+def _walk(directory, prefix, matcher):
+    """
+    Yields the relative path and `os.DirEntry` of every file under the given
+    directory that is not ignored, without following symbolic links. Paths
+    start with the given prefix, the relative path of the directory itself,
+    and use forward slashes.
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        path = prefix + entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if matcher.matches(path, is_dir):
+            continue
+        if is_dir:
+            for child in _walk(entry.path, path + "/", matcher):
+                yield child
+        else:
+            yield path, entry
+
+
+def _hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(64 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _entry(path, stat, old, racy):
+    """
+    Returns the journal entry of the file at the given path, with the given
+    stat result, and whether it changed since the given old entry, or None.
+    Files modified after `racy`, in nanoseconds, are checked again next time.
+    """
+    metadata = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    if old is not None and old[:3] == metadata:
+        return old, False
+    digest = None
+    if S_ISREG(stat.st_mode) and stat.st_size <= MAX_HASH_SIZE:
+        try:
+            digest = _hash(path)
+        except (IOError, OSError):
+            pass
+    if stat.st_mtime_ns >= racy:
+        # Never matches, so that the file is checked again.
+        metadata[1] = -1
+    changed = old is None or digest is None or old[3] != digest
+    return metadata + [digest], changed
+
+
+def _racy():
+    # `time.time_ns` is only available since Python 3.7.
+    return int(time.time() * 10**9) - RACY_WINDOW
+
+
+def scan(previous):
+    """
+    Walks the current project, skipping ignored paths, returning its journal
+    entries and the set of paths that changed since the given previous
+    entries, including removed ones. Paths are relative to the project root,
+    and use forward slashes like Unison paths.
+
+    Files with new metadata but the same contents, like touched files, are not
+    reported as changed, if small enough to be hashed.
+    """
+    racy = _racy()
+    entries = {}
+    changed = set()
+    for path, entry in _walk(os.curdir, "", ignore.load()):
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        entries[path], is_changed = _entry(entry.path, stat, previous.get(path), racy)
+        if is_changed:
+            changed.add(path)
+    changed.update(path for path in previous if path not in entries)
+    return entries, changed
+
+
+def refresh(entries, paths, matcher):
+    """
+    Updates the given journal entries in place, for the given changed paths
+    only, like reported by the watcher, instead of walking the whole project.
+    Directories are refreshed along with everything in them.
+    """
+    racy = _racy()
+    for path in paths:
+        path = path.replace(os.sep, "/").strip("/")
+        inside = path + "/"
+        old = {}
+        if path in entries:
+            old[path] = entries.pop(path)
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            stat = None
+        if not old and (stat is None or S_ISDIR(stat.st_mode)):
+            # A directory, either still there or removed.
+            for key in [key for key in entries if key.startswith(inside)]:
+                old[key] = entries.pop(key)
+        if stat is None:
+            continue
+        if S_ISDIR(stat.st_mode):
+            files = []
+            for child, entry in _walk(path, inside, matcher):
+                try:
+                    files.append((child, entry.path, entry.stat(follow_symlinks=False)))
+                except OSError:
+                    pass
+        elif matcher.is_ignored(path):
+            files = []
+        else:
+            files = [(path, path, stat)]
+        for key, filename, file_stat in files:
+            entries[key] = _entry(filename, file_stat, old.get(key), racy)[0]
+    return entries
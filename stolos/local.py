@@ -0,0 +1,211 @@
+"""
+Helpers for the local directory of a Stolos project, managing its `.stolos`
+files and the environment needed by Docker Compose and Unison.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import string
+import tempfile
+
+from stolos import VERSION, compose, config, ignore, utils
+
+
+# How many rendered `stolos env` outputs to keep, e.g. one per shell.
+ENV_CACHE_SIZE = 8
+
+
+def initialize_project(stolos_url, project):
+    """
+    Initialize a Stolos project with the needed files, using the response from
+    the server.
+    """
+    config.update_project_config(
+        {
+            "project": {
+                "uuid": project["uuid"],
+                "stack": project["stack"]["slug"] if project["stack"] else None,
+                "public-url": project["routing_config"]["domain"],
+                "subdomains": project["routing_config"]["config"]["subdomains"],
+            },
+            "user": {"default-api-server": stolos_url},
+            "server": {"host": project["server"]["host"]},
+        }
+    )
+    with open(".stolos/ca.pem", "w+") as ca_pem:
+        ca_pem.write(project["server"]["docker_ca_pem"])
+        os.chmod(".stolos/ca.pem", 0o600)
+    if project["stack"]:
+        with open("docker-compose.yaml", "w+") as docker_compose:
+            docker_compose.write(project["stack"]["docker_compose_file"])
+    with open(".stolos/default.prf", "w+") as default_profile:
+        default_profile.write(
+            """
+# Default unison profile for UNIX systems
+include common
+
+"""
+        )
+    with open(".stolos/win.prf", "w+") as windows_profile:
+        windows_profile.write(
+            """
+# Unison profile for Windows systems
+perms = 0
+
+include common
+
+"""
+        )
+    with open(".stolos/common", "w+") as common:
+        common.write(
+            string.Template(
+                """
+# Roots of the synchronization
+root = .
+root = ssh://stolos@${STOLOS_SERVER}//mnt/stolos/${STOLOS_PROJECT_ID}
+
+ui = text
+addversionno = true
+prefer = newer
+fastcheck = true
+ignore = Path .stolos
+silent = true
+
+# Rules compiled from .gitignore, .dockerignore and .stolosignore
+include ignore
+
+# Enable this option and set it to 'all' or 'verbose' for debugging
+# debug = verbose
+
+"""
+            ).substitute(
+                STOLOS_PROJECT_ID=project["uuid"],
+                STOLOS_SERVER=project["server"]["host"],
+            )
+        )
+    ignore.update()
+
+
+def deinitialize_project():
+    """
+    Deinitialize a Stolos project, deleting the `.stolos` directory.
+    """
+    if os.path.isdir(".stolos"):
+        shutil.rmtree(".stolos", ignore_errors=True)
+
+
+def get_environ(cnf):
+    """
+    Gets the needed environment for Stolos.
+    """
+    compose_file_path = compose.find()
+    public_url = cnf["project"]["public-url"]
+    env = {
+        "STOLOS_PUBLIC_URL": public_url,
+        "STOLOS_UUID": cnf["project"]["uuid"],
+        "COMPOSE_PROJECT_NAME": cnf["project"]["uuid"].replace("-", ""),
+        "COMPOSE_FILE": compose_file_path,
+        "DOCKER_HOST": "tcp://{}:2376".format(cnf["server"]["host"]),
+        "DOCKER_CERT_PATH": os.path.join(os.getcwd(), ".stolos"),
+        "DOCKER_TLS_VERIFY": "1",
+        "STOLOS_REMOTE_DIR": "/mnt/stolos/{}/".format(cnf["project"]["uuid"]),
+        "UNISON": os.path.join(os.getcwd(), ".stolos"),
+    }
+    if cnf["project"]["stack"]:
+        env["STOLOS_STACK_SLUG"] = cnf["project"]["stack"]
+        env["STOLOS_STACK_NAME"] = os.path.basename(cnf["project"]["stack"])
+    compose_file = compose.load(compose_file_path)
+    services = compose_file.services if compose_file else []
+    for service in services:
+        if service.ports is None:
+            continue
+        normalized_service = re.sub(r"[^a-zA-Z0-9_]", "_", service.name.upper())
+        service_key = "STOLOS_PUBLIC_URL_{}".format(normalized_service)
+        env[service_key] = utils.get_url_for_service_port(cnf, service.name)
+        for port in service.ports:
+            service_port_key = "{}_{}".format(service_key, port)
+            env[service_port_key] = utils.get_url_for_service_port(
+                cnf, service.name, port
+            )
+    return env
+
+
+def config_environ(cnf):
+    """
+    Configures the environment with any needed environment variables for compose
+    and Unison. Also updates the docker certificates to the latest valid from
+    user config.
+    """
+    cnf = config.get_config()
+    server = cnf["user"]["default-api-server"]
+    with open(".stolos/cert.pem", "w+") as cert_pem:
+        cert_pem.write(cnf["user"][server].get("cert-pem", ""))
+        os.chmod(".stolos/cert.pem", 0o600)
+    with open(".stolos/key.pem", "w+") as key_pem:
+        key_pem.write(cnf["user"][server].get("key-pem", ""))
+    os.environ.update(get_environ(cnf))
+
+
+def _env_cache_key(*args):
+    """
+    Returns the key of a rendered `stolos env` output, for the current project
+    and the given arguments. The key changes whenever any of the config files
+    or compose files the output depends on change.
+    """
+    paths = list(config.get_config_paths())
+    paths.extend(
+        os.path.join(os.getcwd(), filename) for filename in compose.COMPOSE_FILES
+    )
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stamps.append((path, None))
+            continue
+        stamps.append((path, stat.st_mtime, stat.st_size))
+    key = json.dumps([VERSION, os.getcwd(), list(args), stamps])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def get_cached_env(*args):
+    """
+    Returns the `stolos env` output rendered for the given arguments, if it is
+    still valid, or None.
+    """
+    try:
+        with open(".stolos/env-cache.json", "r") as fin:
+            entries = json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
+    key = _env_cache_key(*args)
+    for entry_key, output in entries:
+        if entry_key == key:
+            return output
+    return None
+
+
+def store_cached_env(output, *args):
+    """
+    Stores the `stolos env` output rendered for the given arguments, keeping
+    only the most recent entries.
+    """
+    try:
+        with open(".stolos/env-cache.json", "r") as fin:
+            entries = json.load(fin)
+    except (IOError, OSError, ValueError):
+        entries = []
+    key = _env_cache_key(*args)
+    entries = [[key, output]] + [entry for entry in entries if entry[0] != key]
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=".stolos", suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as fout:
+            json.dump(entries[:ENV_CACHE_SIZE], fout)
+        os.replace(tmp_path, ".stolos/env-cache.json")
+    except (IOError, OSError):
+        os.remove(tmp_path)
@@ -0,0 +1,155 @@
+"""
+Multiplexer of the output of the processes run by `stolos up`. The output of
+each process is line buffered and printed prefixed with its source, the sync or
+the name of a service, so that lines of different sources never interleave.
+Sources can be filtered, and are rate limited so that chatty services cannot
+flood the terminal.
+"""
+import fnmatch
+import os
+import re
+import threading
+import time
+
+import click
+
+
+# Source of the lines of `docker-compose logs`, which are split per service.
+SERVICES = "services"
+
+# Source of the lines of `docker-compose logs` not coming from a service, like
+# the errors of Docker Compose itself.
+COMPOSE = "compose"
+
+# Default maximum number of lines printed per second, per source.
+DEFAULT_RATE = 100
+
+# Longest partial line to buffer, in bytes, before printing it anyway.
+MAX_LINE_LENGTH = 64 * 1024
+
+# A line of `docker-compose logs`, like `project_web_1  | message`.
+SERVICE_LINE = re.compile(r"^(\S+)\s+\| ?(.*)$")
+
+# ANSI escape sequences, as used by Docker Compose to color its prefixes.
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+# Colors of the prefixes of the sources, in order of appearance.
+COLORS = ["cyan", "yellow", "green", "magenta", "blue", "red"]
+
+
+class _Source(object):
+    """
+    Rate limiting state of a source, as a token bucket.
+    """
+
+    def __init__(self, rate, color):
+        self.rate = rate
+        self.color = color
+        self.tokens = rate
+        self.updated = time.time()
+        self.dropped = 0
+
+    def allow(self):
+        if not self.rate:
+            return True
+        now = time.time()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Multiplexer(object):
+    """
+    Prints the output of several streams, one line at a time. Sources are
+    included or excluded using shell-style patterns, and each source prints at
+    most `rate` lines per second, dropping the rest. A `rate` of 0 disables
+    rate limiting.
+    """
+
+    def __init__(self, include=None, exclude=None, rate=DEFAULT_RATE):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.rate = rate
+        self.buffers = {}
+        self.sources = {}
+        self.width = 0
+        self.lock = threading.Lock()
+        self.project_name = os.environ.get("COMPOSE_PROJECT_NAME", "")
+
+    def feed(self, source, data):
+        """
+        Adds output of the given source, printing any complete lines.
+        """
+        with self.lock:
+            buffer = self.buffers.get(source, b"") + data
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            if len(buffer) > MAX_LINE_LENGTH:
+                lines.append(buffer)
+                buffer = b""
+            self.buffers[source] = buffer
+            for line in lines:
+                self._echo(source, line.decode("utf-8", "replace").rstrip("\r"))
+
+    def close(self, source):
+        """
+        Prints any remaining partial line of the given source.
+        """
+        with self.lock:
+            buffer = self.buffers.pop(source, b"")
+            if buffer:
+                self._echo(source, buffer.decode("utf-8", "replace").rstrip("\r"))
+
+    def is_shown(self, source):
+        """
+        Returns True if lines of the given source pass the filters.
+        """
+        if self.include and not any(
+            fnmatch.fnmatch(source, pattern) for pattern in self.include
+        ):
+            return False
+        return not any(fnmatch.fnmatch(source, pattern) for pattern in self.exclude)
+
+    def _service(self, container):
+        """
+        Returns the service of a container name, like `web` for
+        `project_web_1` or `project-web-1`.
+        """
+        for separator in "_-":
+            prefix = self.project_name + separator
+            if self.project_name and container.startswith(prefix):
+                container = container[len(prefix) :]
+                break
+        return re.sub(r"[_-]\d+$", "", container)
+
+    def _echo(self, source, line):
+        if source == SERVICES:
+            match = SERVICE_LINE.match(ANSI_ESCAPE.sub("", line))
+            if match is not None:
+                source, line = self._service(match.group(1)), match.group(2)
+            elif line.strip():
+                source = COMPOSE
+            else:
+                return
+        if not self.is_shown(source):
+            return
+        state = self.sources.get(source)
+        if state is None:
+            state = _Source(self.rate, COLORS[len(self.sources) % len(COLORS)])
+            self.sources[source] = state
+            self.width = max(self.width, len(source))
+        if not state.allow():
+            return
+        prefix = click.style("{} |".format(source.ljust(self.width)), fg=state.color)
+        if state.dropped:
+            click.echo(
+                "{} ({} lines dropped, over {} lines/s)".format(
+                    prefix, state.dropped, state.rate
+                )
+            )
+            state.dropped = 0
+        click.echo("{} {}".format(prefix, line))
@@ -0,0 +1,229 @@
+"""
+Instrumentation of one-off Unison runs. The output of Unison is captured and
+parsed into per-run statistics: how long connecting, scanning and propagating
+took, and how much was transferred. Each run is appended to an NDJSON log in
+`.stolos`, to tell whether slow syncs are caused by the network, the scan or
+the remote. Only the latest runs are kept, as watched syncs add a run for
+every change.
+
+Unison does not report how many files it scanned nor how many bytes it sent,
+so the bytes are estimated from the sizes of the copied files, which is an
+upper bound when only parts of files are sent.
+"""
+import datetime
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+
+# Path of the metrics log, relative to the project root.
+METRICS = ".stolos/metrics.ndjson"
+
+# Size of the metrics log in bytes above which it is truncated, and the number
+# of the latest runs kept when it is.
+MAX_METRICS_SIZE = 1024 * 1024
+KEPT_RECORDS = 1000
+
+# Status messages of Unison, starting each phase of a run.
+CONNECTED = "Looking for changes"
+SCANNED = "Reconciling changes"
+PROPAGATING = "Propagating updates"
+
+# Summary of a Unison run, like `(3 items transferred, 0 skipped, 1 failed)`.
+SUMMARY = re.compile(r"\((\d+) items? transferred, (\d+) skipped, (\d+) failed\)")
+
+# A completed copy of a file, in either direction.
+COPIED = re.compile(r"^\[END\] (?:Copying|Updating file) (.+?)\s*$")
+
+# A conflicting change, as listed by Unison before propagating.
+CONFLICT = "<-?->"
+
+# Seconds to wait for the rest of the output of Unison once it exits. An SSH
+# control master started by Unison keeps the output pipe open after it exits.
+DRAIN_TIMEOUT = 1
+
+
+class SyncStats(object):
+    """
+    Statistics of a single Unison run, built from its output.
+    """
+
+    def __init__(self, kind, paths=0):
+        self.kind = kind
+        self.paths = paths
+        self.started = time.time()
+        self.phases = {}
+        self.returncode = None
+        self.duration = None
+        self.transferred = 0
+        self.skipped = 0
+        self.failed = 0
+        self.conflicts = 0
+        self.bytes = 0
+
+    def feed(self, line):
+        """
+        Updates the statistics with a line of the output of Unison.
+        """
+        now = time.time()
+        for message in (CONNECTED, SCANNED, PROPAGATING):
+            if line.startswith(message):
+                self.phases.setdefault(message, now)
+        if CONFLICT in line:
+            self.conflicts += 1
+        match = SUMMARY.search(line)
+        if match is not None:
+            self.transferred, self.skipped, self.failed = map(int, match.groups())
+        match = COPIED.match(line)
+        if match is not None:
+            try:
+                self.bytes += os.path.getsize(match.group(1))
+            except OSError:
+                pass
+
+    def finish(self, returncode):
+        self.returncode = returncode
+        self.duration = time.time() - self.started
+
+    def _phase(self, start, end):
+        """
+        Returns the seconds between the start of the given phases, where None
+        is the start or the end of the run, or None if a phase did not happen.
+        """
+        start = self.started if start is None else self.phases.get(start)
+        end = self.started + self.duration if end is None else self.phases.get(end)
+        if start is None or end is None:
+            return None
+        return round(end - start, 3)
+
+    def to_dict(self):
+        # Runs with nothing to do end after scanning.
+        scan_end = SCANNED if SCANNED in self.phases else None
+        return {
+            "time": datetime.datetime.utcfromtimestamp(self.started).isoformat() + "Z",
+            "kind": self.kind,
+            "paths": self.paths,
+            "returncode": self.returncode,
+            "duration": round(self.duration, 3),
+            "connect": self._phase(None, CONNECTED),
+            "scan": self._phase(CONNECTED, scan_end),
+            "propagate": self._phase(PROPAGATING, None),
+            "transferred": self.transferred,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "conflicts": self.conflicts,
+            "bytes": self.bytes,
+        }
+
+    def summary(self):
+        """
+        Returns a human readable summary of the run.
+        """
+        stats = self.to_dict()
+        phases = ", ".join(
+            "{} {:.2f}s".format(name, stats[name])
+            for name in ("connect", "scan", "propagate")
+            if stats[name] is not None
+        )
+        return (
+            "Synced in {duration:.2f}s ({phases})\n"
+            "{transferred} transferred, {skipped} skipped, {failed} failed, "
+            "{conflicts} conflicts, {size} copied"
+        ).format(
+            phases=phases or "no phases", size=_format_size(stats["bytes"]), **stats
+        )
+
+
+def _format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return "{:.0f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} GiB".format(size)
+
+
+def run(command, kind, paths=0):
+    """
+    Runs the given Unison command to completion, capturing its output, and
+    records its statistics. Unison is killed if interrupted. Returns the
+    statistics and the output.
+
+    The output is read on another thread, until Unison exits, rather than
+    until the output is closed, which processes started by Unison can delay.
+    """
+    stats = SyncStats(kind, paths)
+    output = []
+    p = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL,
+    )
+    reader = threading.Thread(target=_read, args=(p.stdout, stats, output))
+    reader.daemon = True
+    reader.start()
+    try:
+        returncode = p.wait()
+    except BaseException:
+        # Like `subprocess.call`, do not leave Unison behind when interrupted.
+        p.kill()
+        p.wait()
+        raise
+    reader.join(DRAIN_TIMEOUT)
+    stats.finish(returncode)
+    record(stats)
+    return stats, "".join(output)
+
+
+def _read(stream, stats, output):
+    """
+    Reads the given output of Unison to its end, feeding it to the given
+    statistics and appending it to the given list.
+    """
+    try:
+        for line in stream:
+            line = line.decode("utf-8", "replace")
+            output.append(line)
+            # Progress updates overwrite each other using carriage returns.
+            for part in line.split("\r"):
+                stats.feed(part.strip("\n"))
+    finally:
+        stream.close()
+
+
+def record(stats):
+    """
+    Appends the given statistics to the metrics log of the current project,
+    truncating it to the latest runs once it grows too large.
+    """
+    if not os.path.isdir(os.path.dirname(METRICS)):
+        return
+    try:
+        with open(METRICS, "a") as fout:
+            fout.write(json.dumps(stats.to_dict(), sort_keys=True) + "\n")
+            size = fout.tell()
+        if size > MAX_METRICS_SIZE:
+            _truncate()
+    except (IOError, OSError):
+        pass
+
+
+def _truncate():
+    """
+    Rewrites the metrics log with only its latest `KEPT_RECORDS` runs.
+    """
+    with open(METRICS, "r") as fin:
+        lines = fin.readlines()[-KEPT_RECORDS:]
+    directory = os.path.dirname(METRICS)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fout:
+            fout.writelines(lines)
+        os.replace(tmp_path, METRICS)
+    except (IOError, OSError):
+        os.remove(tmp_path)
+        raise
@@ -4,8 +4,6 @@ Helper functions for detecting the user's current shell.
 import os
 import os.path
 
-import click
-
 
 ENV_TEMPLATE = """
 {env_vars}\
@@ -87,15 +85,13 @@ def usage_hint(command, shell):
         return ("eval $({command})".format(command=command), "#")
 
 
-def print_env_eval(command, shell, env_dict):
+def render_env_eval(command, shell, env_dict):
     """
-    Prints the environment evaluation snippet, given a shell and an environment
-    dict.
+    Returns the environment evaluation snippet, given a shell and an
+    environment dict.
     """
     if not shell:
         shell = detect()
-    if not shell:
-        click.echo("Shell could not be detected, falling back to bash", err=True)
     config = shell_config(shell)
     hint, comment = usage_hint(command, shell)
     uhint = "{} Run this command to configure your shell: \n{} {}\n".format(
@@ -108,5 +104,4 @@ def print_env_eval(command, shell, env_dict):
         config["val"] = env_dict[key]
         env_vars = env_vars + "{prefix}{key}{delimiter}{val}{suffix}".format(**config)
     config["env_vars"] = env_vars
-    msg = ENV_TEMPLATE.format(**config)
-    click.echo(msg)
+    return ENV_TEMPLATE.format(**config)
@@ -0,0 +1,87 @@
+"""
+SSH connections to the server of a Stolos project. All the SSH connections of
+a project share a single control master, so that only the first one pays for
+the key exchange, while the rest, like each Unison run, reuse it.
+"""
+import hashlib
+import os
+import subprocess
+
+from stolos import utils
+
+
+# Longest path of the control socket, below the limit of unix socket paths.
+MAX_CONTROL_PATH = 100
+
+# Seconds the control master outlives its last connection, so that one-off
+# syncs reuse it, and so that it goes away even when it is not stopped.
+CONTROL_PERSIST = 600
+
+
+def control_path():
+    """
+    Returns the path of the control socket of the current project, in its
+    `.stolos` directory. Falls back to a short path in `~/.ssh`, which only the
+    user can access, when that path is too long for a unix socket, or has
+    spaces, which Unison would split its SSH arguments on.
+    """
+    path = os.path.abspath(os.path.join(".stolos", "ssh-control"))
+    if len(path) <= MAX_CONTROL_PATH and " " not in path:
+        return path
+    directory = os.path.join(os.path.expanduser("~"), ".ssh")
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, "stolos-{}".format(digest))
+
+
+def options():
+    """
+    Returns the SSH options sharing the control master of the project, or none
+    where control masters are not supported.
+    """
+    if utils.is_windows():
+        return []
+    return [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        "ControlPath={}".format(control_path()),
+        "-o",
+        "ControlPersist={}".format(CONTROL_PERSIST),
+    ]
+
+
+def destination(cnf):
+    return "stolos@{}".format(cnf["server"]["host"])
+
+
+def command(cnf, identity_file):
+    """
+    Returns the SSH command connecting to the server of the project.
+    """
+    return ["ssh", "-i", identity_file] + options() + [destination(cnf)]
+
+
+def unison_args(identity_file):
+    """
+    Returns the value of the Unison `-sshargs` option.
+    """
+    return " ".join(["-i", identity_file] + options())
+
+
+def stop(cnf):
+    """
+    Stops the control master of the project from accepting new connections, if
+    it is running, so that it exits once the connections of other commands
+    still using it, like a running `stolos up`, are closed.
+    """
+    if utils.is_windows() or not os.path.exists(control_path()):
+        return
+    subprocess.call(
+        ["ssh", "-O", "stop", "-o", "ControlPath={}".format(control_path())]
+        + [destination(cnf)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
@@ -0,0 +1,294 @@
+"""
+Supervisor of the long running processes of `stolos up`, like the continuous
+sync and the services logs. Child exits are detected as soon as they happen,
+through `SIGCHLD` delivered to a wakeup file descriptor, instead of polling
+every child on an interval. Platforms without `SIGCHLD` fall back to polling.
+
+Children may have their output piped to a `stolos.logs.Multiplexer`, which is
+read without blocking in the same loop, or on threads where pipes cannot be
+selected.
+"""
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+
+import click
+
+
+# Seconds between polls of the children, where `SIGCHLD` is not available.
+POLL_INTERVAL = 0.25
+
+# Seconds to wait for children to exit after terminating them, before killing
+# them.
+TERMINATE_TIMEOUT = 10
+
+# Delay before the first restart of a child, doubled on each further restart,
+# up to `MAX_RESTART_DELAY` seconds.
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+# Seconds a restarted child must run for its restart delay to be reset.
+STABLE_TIME = 60
+
+
+class _Child(object):
+    """
+    A supervised child process, along with how to start it again.
+    """
+
+    def __init__(self, name, start, restart, source):
+        self.name = name
+        self.start = start
+        self.restart = restart
+        self.source = source
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.restart_at = None
+
+    def spawn(self):
+        self.process = self.start()
+        self.started = time.time()
+        self.restart_at = None
+
+    def restart_delay(self):
+        if time.time() - self.started >= STABLE_TIME:
+            self.restarts = 0
+        delay = min(RESTART_DELAY * 2 ** self.restarts, MAX_RESTART_DELAY)
+        self.restarts += 1
+        return delay
+
+
+class Supervisor(object):
+    """
+    Runs child processes until one of them exits without being restartable, or
+    until interrupted by the user, and then terminates all of them.
+    """
+
+    def __init__(self, terminate_timeout=TERMINATE_TIMEOUT, multiplexer=None):
+        self.terminate_timeout = terminate_timeout
+        self.multiplexer = multiplexer
+        self.children = []
+        self.interrupted = False
+        self.wakeup = None
+
+    def add(self, name, start, restart=False, source=None):
+        """
+        Adds a child, where `start` is a function starting it and returning its
+        `subprocess.Popen`. Children with `restart` set are started again, with
+        exponential backoff, whenever they exit.
+
+        If the child pipes its stdout, the output is fed to the multiplexer of
+        the supervisor as coming from `source`.
+        """
+        self.children.append(_Child(name, start, restart, source))
+
+    def run(self):
+        """
+        Starts all the children and supervises them, returning a message with
+        the reason they were stopped.
+        """
+        self.wakeup = _Wakeup()
+        previous = signal.signal(signal.SIGINT, self._interrupt)
+        try:
+            for child in self.children:
+                self._spawn(child)
+            return self._supervise()
+        finally:
+            self.stop()
+            for child in self.children:
+                self._drain(child)
+            signal.signal(signal.SIGINT, previous)
+            self.wakeup.close()
+
+    def _interrupt(self, *args):
+        self.interrupted = True
+
+    def _spawn(self, child):
+        child.spawn()
+        stream = child.process.stdout
+        if stream is None or self.multiplexer is None:
+            return
+        if self.wakeup.selector is None:
+            thread = threading.Thread(target=self._pump, args=(child, stream))
+            thread.daemon = True
+            thread.start()
+            return
+        os.set_blocking(stream.fileno(), False)
+        self.wakeup.selector.register(stream, selectors.EVENT_READ, child)
+
+    def _pump(self, child, stream):
+        """
+        Feeds the output of a child to the multiplexer until it is closed, for
+        platforms where pipes cannot be selected.
+        """
+        for data in iter(lambda: os.read(stream.fileno(), 65536), b""):
+            self.multiplexer.feed(child.source, data)
+        self.multiplexer.close(child.source)
+
+    def _read(self, child, stream):
+        """
+        Feeds the available output of a child to the multiplexer, returning
+        True if there may be more of it to read right away.
+        """
+        try:
+            data = os.read(stream.fileno(), 65536)
+        except (BlockingIOError, InterruptedError):
+            return False
+        if not data:
+            self._close(child, stream)
+            return False
+        self.multiplexer.feed(child.source, data)
+        return True
+
+    def _close(self, child, stream):
+        self.wakeup.selector.unregister(stream)
+        self.multiplexer.close(child.source)
+        stream.close()
+
+    def _drain(self, child):
+        """
+        Feeds the remaining output of an exited child to the multiplexer, and
+        stops reading its stdout.
+        """
+        if self.multiplexer is None or self.wakeup.selector is None:
+            return
+        stream = child.process.stdout if child.process else None
+        if stream is None or stream.closed:
+            return
+        while self._read(child, stream):
+            pass
+        if not stream.closed:
+            # Still held open by some descendant of the child.
+            self._close(child, stream)
+
+    def _supervise(self):
+        while True:
+            if self.interrupted:
+                return "Terminated by user"
+            now = time.time()
+            for child in self.children:
+                if child.restart_at is not None:
+                    if child.restart_at <= now:
+                        click.echo("Restarting {}...".format(child.name.lower()))
+                        self._spawn(child)
+                    continue
+                if child.process.poll() is None:
+                    continue
+                self._drain(child)
+                if not child.restart:
+                    return '{} exited with exit code "{}"'.format(
+                        child.name, child.process.returncode
+                    )
+                delay = child.restart_delay()
+                child.restart_at = now + delay
+                click.echo(
+                    '{} exited with exit code "{}", restarting in {}s'.format(
+                        child.name, child.process.returncode, delay
+                    )
+                )
+            deadlines = [
+                child.restart_at
+                for child in self.children
+                if child.restart_at is not None
+            ]
+            timeout = max(0, min(deadlines) - time.time()) if deadlines else None
+            for key in self.wakeup.wait(timeout):
+                self._read(key.data, key.fileobj)
+
+    def stop(self):
+        """
+        Terminates all the running children at once, waiting for them to exit
+        in parallel and killing those still running after the timeout.
+        """
+        running = [
+            child.process
+            for child in self.children
+            if child.process is not None and child.process.poll() is None
+        ]
+        for process in running:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        deadline = time.time() + self.terminate_timeout
+        for process in running:
+            try:
+                process.wait(max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+                process.wait()
+
+
+class _Wakeup(object):
+    """
+    Waits for signals about child processes and for output of their pipes.
+    Where `SIGCHLD` is not available, or wakeup file descriptors cannot be set,
+    children are polled instead. Pipes cannot be selected on Windows, where
+    there is no selector at all.
+    """
+
+    def __init__(self):
+        self.selector = None
+        self.read_fd = None
+        if not hasattr(signal, "SIGCHLD"):
+            return
+        self.selector = selectors.DefaultSelector()
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        try:
+            self.previous_fd = signal.set_wakeup_fd(write_fd)
+        except ValueError:
+            # Not in the main thread.
+            os.close(read_fd)
+            os.close(write_fd)
+            return
+        # A handler must be installed for the signal to reach the wakeup fd.
+        self.previous_handler = signal.signal(signal.SIGCHLD, _ignore)
+        self.read_fd, self.write_fd = read_fd, write_fd
+        self.selector.register(read_fd, selectors.EVENT_READ)
+
+    def wait(self, timeout):
+        """
+        Blocks until a signal arrives or a pipe is readable, or for at most
+        `timeout` seconds, returning the selector keys of the readable pipes.
+        """
+        if self.read_fd is None:
+            if timeout is None or timeout > POLL_INTERVAL:
+                timeout = POLL_INTERVAL
+        if self.selector is None:
+            time.sleep(timeout)
+            return []
+        ready = []
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj != self.read_fd:
+                ready.append(key)
+                continue
+            try:
+                while os.read(self.read_fd, 512):
+                    pass
+            except (BlockingIOError, InterruptedError):
+                pass
+        return ready
+
+    def close(self):
+        if self.selector is None:
+            return
+        self.selector.close()
+        if self.read_fd is None:
+            return
+        signal.set_wakeup_fd(self.previous_fd)
+        signal.signal(signal.SIGCHLD, self.previous_handler)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def _ignore(*args):
+    pass
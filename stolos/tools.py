@@ -0,0 +1,334 @@
+"""
+Helpers for running the external tools used by the Stolos CLI, like Docker
+Compose, Unison and the version control systems of services.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+from six import iteritems
+
+from stolos import config, ignore, local, metrics, ssh, utils
+from stolos.compose import find as find_compose_file, load as load_compose_file
+
+
+# Default number of service repositories cloned at once.
+DEFAULT_CLONE_WORKERS = 4
+
+# SSH command of clones run in parallel, failing instead of prompting.
+BATCH_SSH = "ssh -o BatchMode=yes"
+
+
+def initialize_services(workers=DEFAULT_CLONE_WORKERS, shallow=False, partial=False):
+    """
+    Clones the repositories of the services of the project, as given by their
+    `STOLOS_REPO_URL`, running up to `workers` clones at once. The output of
+    each clone is captured and printed prefixed with its service, once done.
+
+    `shallow` and `partial` make Git clones fetch only the latest commit or no
+    file contents up front, respectively, and are ignored for Mercurial.
+
+    Clones run in parallel fail instead of prompting for credentials or host
+    keys, as prompts of several clones cannot be answered. With a single
+    worker, clones run one at a time on the terminal, and can prompt.
+    """
+    compose_file = load_compose_file(os.path.join(os.getcwd(), "docker-compose.yaml"))
+    if compose_file is None:
+        return
+    clone_urls = compose_file.repo_urls
+    results = {"success": [], "failure": []}
+    if len(clone_urls) == 0:
+        return
+    click.secho("Initializing services", bold=True)
+    start = time.time()
+    interactive = workers <= 1
+    clones = []
+    for service, url in iteritems(clone_urls):
+        service_dir = url.rstrip().split(" ")[-1]
+        if os.path.exists(service_dir):
+            results["success"].append(
+                'Service "{}" is already initialized.'.format(service)
+            )
+            continue
+        if url.startswith("git+"):
+            scm = "git"
+            clone_url = url[4:]
+        elif url.startswith("hg+"):
+            scm = "hg"
+            clone_url = url[3:]
+        else:
+            results["failure"].append(
+                'Service "{}" initialization failed.\nPattern of repository url "{}" could not be resolved.'.format(
+                    service, url
+                )
+            )
+            continue
+        args = [scm, "clone"]
+        if scm == "hg" and not interactive:
+            args.extend(["--noninteractive", "--config", "ui.ssh={}".format(BATCH_SSH)])
+        if scm == "git" and shallow:
+            args.extend(["--depth", "1"])
+        if scm == "git" and partial:
+            args.append("--filter=blob:none")
+        clone_args = clone_url.strip().split(" ")
+        clones.append((service, scm, clone_args[0], args + clone_args))
+    width = max([len(clone[0]) for clone in clones] or [0])
+    env = None if interactive else _batch_environ()
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        futures = [executor.submit(_clone, *clone, env=env) for clone in clones]
+        for future in as_completed(futures):
+            service, success, message, output = future.result()
+            for line in output.splitlines():
+                click.echo("{} | {}".format(service.ljust(width), line))
+            results["success" if success else "failure"].append(message)
+
+    # Inform about successful initializations
+    for success in results["success"]:
+        click.echo(success)
+
+    # Inform about failed initializations
+    for failure in results["failure"]:
+        click.secho(failure, bold=True)
+
+    click.echo(
+        "Initialized {} of {} services in {:.1f}s.".format(
+            len(results["success"]), len(clone_urls), time.time() - start
+        )
+    )
+
+
+def _batch_environ():
+    """
+    Returns the environment of clones run in parallel, where Git and SSH fail
+    instead of prompting on the terminal.
+    """
+    env = dict(os.environ)
+    env["GIT_TERMINAL_PROMPT"] = "0"
+    env["GIT_SSH_COMMAND"] = "{} -o BatchMode=yes".format(
+        os.environ.get("GIT_SSH_COMMAND", "ssh")
+    )
+    return env
+
+
+def _clone(service, scm, source, args, env=None):
+    """
+    Runs the given command cloning a service from the repository at `source`,
+    capturing its output, in the given environment. Without one, the clone
+    runs on the terminal instead, where it can prompt. Returns the service,
+    whether the clone succeeded, a message describing the outcome, including
+    how long it took, and the output.
+    """
+    start = time.time()
+    if env is None:
+        options = {}
+    else:
+        options = dict(
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            env=env,
+        )
+    try:
+        init_process = subprocess.Popen(args, **options)
+    except OSError as e:
+        if e.errno == 2:
+            message = 'Service "{}" initialization from "{}" failed.\nPlease install {} and attempt to manually initialize.'.format(
+                service, source, scm
+            )
+        else:
+            message = 'Service "{}" initialization from "{}" failed with the following error:\n\t{}'.format(
+                service, source, e
+            )
+        return service, False, message, ""
+    output, _ = init_process.communicate()
+    output = (output or b"").decode("utf-8", "replace")
+    if init_process.returncode == 0:
+        message = 'Service "{}" was successfully initialized in {:.1f}s.'.format(
+            service, time.time() - start
+        )
+        return service, True, message, output
+    message = 'Service "{}" initialization from "{}" failed after {:.1f}s.\nPlease attempt to manually initialize.'.format(
+        service, source, time.time() - start
+    )
+    return service, False, message, output
+
+
+def compose(args, capture=False):
+    """
+    Run Docker Compose, with the given arguments. These arguments should be in
+    array form `['-d', '--build']`, not as a single string. With `capture`, the
+    output is piped instead of printed, as the stdout of the process.
+    """
+    p = subprocess.Popen(["docker-compose"] + args, stdin=sys.stdin, **_output(capture))
+    return p
+
+
+def check_docker():
+    """
+    Checks that the Docker daemon of the project is reachable over TLS, using
+    `docker version`. Returns whether it is, and the output of the check. The
+    check is skipped, passing, without the Docker CLI, which Docker Compose
+    does not need.
+    """
+    if shutil.which("docker") is None:
+        return True, ""
+    return _run(["docker", "version"])
+
+
+def prepare_services():
+    """
+    Pulls the images of the services of the project that are not built from a
+    context, and creates their containers, networks and volumes without
+    starting them. These do not depend on the synced files, so they can be
+    prepared while the files are still syncing. Returns whether preparing them
+    succeeded, and the output of Docker Compose. Their dependencies are left
+    alone, as they may be built from the synced files.
+    """
+    compose_file = load_compose_file(find_compose_file())
+    if compose_file is None:
+        return True, ""
+    services = [service.name for service in compose_file.services if not service.build]
+    if not services:
+        return True, ""
+    success, output = _run(["docker-compose", "pull"] + services)
+    if not success:
+        return success, output
+    return _run(
+        ["docker-compose", "up", "--no-start", "--no-build", "--no-deps"] + services
+    )
+
+
+def _run(args):
+    """
+    Runs the given command to completion, capturing its output. Returns whether
+    it succeeded, and the output.
+    """
+    try:
+        p = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+        )
+    except OSError as e:
+        return False, "Could not run {}: {}".format(args[0], e)
+    output, _ = p.communicate()
+    return p.returncode == 0, output.decode("utf-8", "replace")
+
+
+def _sync_command(repeat, watch=False, paths=None):
+    """
+    Returns the Unison command syncing the current project, as described by
+    `sync`. The environment must already be configured, with
+    `local.config_environ`.
+    """
+    cnf = config.get_config()
+    ignore.update()
+    args = []
+    args.insert(0, ssh.unison_args(get_identity_file(cnf)))
+    args.insert(0, "-sshargs")
+    if repeat and not watch:
+        args.insert(0, "2")
+        args.insert(0, "-repeat")
+    elif not repeat:
+        args.insert(0, "false")
+        args.insert(0, "-fastcheck")
+    for path in paths or []:
+        args.extend(["-path", path])
+    if utils.is_windows():
+        args.insert(0, "win")
+    command = ["unison"] + args
+    if repeat and watch:
+        command = [sys.executable, "-m", "stolos.watcher", "--"] + command
+    return command
+
+
+def sync(repeat, capture=False, watch=False, paths=None):
+    """
+    Starts a project sync using Unison. Takes an extra parameter, which makes
+    the synchronization repeat using Unison `-repeat` or not. With `capture`,
+    the output is piped instead of printed, as the stdout of the process. The
+    environment must already be configured, with `local.config_environ`.
+
+    With `watch`, a repeating sync is driven by `stolos.watcher` instead, which
+    syncs only the changed paths as soon as they change. With `paths`, only the
+    given paths, relative to the project root, are synced.
+    """
+    command = _sync_command(repeat, watch=watch, paths=paths)
+    p = subprocess.Popen(command, stdin=sys.stdin, **_output(capture))
+    return p
+
+
+def sync_once(paths=None, kind="oneoff", show_stats=False):
+    """
+    Syncs the project once, like `sync`, recording the statistics of the run
+    in the metrics log under the given kind. The output of Unison is only
+    printed if the sync fails, while `show_stats` prints a summary of the
+    statistics. Returns the exit code of Unison, or 0 if all the given paths
+    are ignored.
+    """
+    if paths:
+        matcher = ignore.load()
+        paths = [
+            path for path in paths if not matcher.is_ignored(path, os.path.isdir(path))
+        ]
+        if not paths:
+            # Syncing no paths would sync everything instead.
+            return 0
+    command = _sync_command(False, paths=paths) + ["-batch", "-silent=false"]
+    stats, output = metrics.run(command, kind, len(paths or []))
+    if stats.returncode != 0:
+        click.echo(output, nl=False)
+    if show_stats:
+        click.echo(stats.summary())
+    return stats.returncode
+
+
+def sync_paths(paths, directory=None):
+    """
+    Syncs the given paths of a Stolos project once, for use by editors and build
+    tools, returning the exit code of Unison. Relative paths are relative to
+    `directory`, defaulting to the current one, which must be inside the
+    project. The current directory is restored afterwards.
+    """
+    cwd = os.getcwd()
+    directory = os.path.abspath(directory or cwd)
+    paths = [os.path.join(directory, path) for path in paths]
+    try:
+        utils.ensure_stolos_directory(directory)
+        local.config_environ(config.get_config())
+        return sync_once(utils.get_project_paths(paths), kind="paths")
+    finally:
+        os.chdir(cwd)
+
+
+def get_identity_file(cnf):
+    """
+    Returns the SSH identity file to connect to the server of the project with,
+    warning if the user has not uploaded a public key.
+    """
+    identity_file = cnf["user"][cnf["user"]["default-api-server"]].get("identity-file")
+    if identity_file is None:
+        click.echo(
+            click.style("[WARNING] ", bold=True)
+            + "No public key was found. Your user's default key will be used."
+        )
+        click.echo("To upload a public ssh key, use the following command:")
+        click.secho("\tstolos keys upload [PUBLIC_KEY_PATH]\n", bold=True)
+        home = os.path.expanduser("~")
+        identity_file = os.path.join(home, ".ssh", "id_rsa")
+    return identity_file
+
+
+def _output(capture):
+    """
+    Returns the output arguments of `subprocess.Popen`, to either pipe the
+    output of a process or print it.
+    """
+    if capture:
+        return {"stdout": subprocess.PIPE, "stderr": subprocess.STDOUT}
+    return {"stdout": sys.stdout, "stderr": sys.stderr}
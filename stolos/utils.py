@@ -0,0 +1,100 @@
+"""
+Helpers shared by the commands of the Stolos CLI.
+"""
+import os
+import sys
+
+from six.moves.urllib.parse import urlparse
+
+from stolos import config, exceptions
+
+
+def get_hostname(url):
+    """Strip url from protocol and trailing slash, in order to use it as config
+    key
+    """
+    from stolos import api
+
+    url = api._ensure_protocol(url)
+    return urlparse(url).hostname
+
+
+def ensure_stolos_directory(base_directory=None, raise_exc=True):
+    """
+    Ensures the existance of a Stolos directory. Either raises an exception, or
+    returns the result.
+
+    If the current directory is not a Stolos directory, recursively traverses
+    towards the parent until it finds one.
+    """
+    if base_directory is None:
+        base_directory = os.getcwd()
+    parent = os.path.abspath(os.path.join(base_directory, os.pardir))
+    if os.path.exists(os.path.join(base_directory, ".stolos")):
+        os.chdir(base_directory)
+        return True
+    if parent == base_directory:
+        if raise_exc:
+            raise exceptions.NotStolosDirectoryException()
+        return False
+    return ensure_stolos_directory(parent, raise_exc)
+
+
+def get_project_paths(paths):
+    """
+    Returns the given absolute paths relative to the root of the current Stolos
+    project, with forward slashes like Unison paths. Paths must be made
+    absolute before changing to the project root, so that they are relative to
+    the directory the user gave them in.
+    """
+    root = os.getcwd()
+    project_paths = []
+    for path in paths:
+        relative = os.path.relpath(path, root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            raise exceptions.PathOutsideProjectException(path)
+        if relative == os.curdir:
+            # The whole project.
+            return []
+        project_paths.append(relative.replace(os.sep, "/"))
+    return project_paths
+
+
+def is_windows():
+    """
+    Detects the current platform, returning True if running in Windows or
+    Cygwin.
+    """
+    return {"win32": True, "cygwin": True}.get(sys.platform, False)
+
+
+def get_url_for_service_port(cnf, service=None, port=None):
+    public_url = cnf["project"]["public-url"]
+    subdomain, _, domain = public_url.partition(".")
+    if service is None and port is None:
+        return "{public_url}".format(public_url=public_url)
+    token = service
+    if port is not None:
+        token = "{token}-{port}".format(token=token, port=port)
+    use_subdomains = cnf["project"].get("subdomains", False)
+    if use_subdomains:
+        return "{token}.{public_url}".format(token=token, public_url=public_url)
+    else:
+        return "{subdomain}-{token}.{domain}".format(
+            subdomain=subdomain, token=token, domain=domain
+        )
+
+
+def ensure_logged_in(stolos_url=None):
+    """
+    Ensures the user is logged in, at the given `stolos_url` Stolos server.
+    Raises an exception if not.
+    """
+    cnf = config.get_config()
+    if "user" not in cnf:
+        raise exceptions.NotLoggedInException()
+    if "default-api-server" not in cnf["user"] and not stolos_url:
+        raise exceptions.NotLoggedInException()
+    stolos_url = stolos_url or cnf["user"]["default-api-server"]
+    if stolos_url not in cnf["user"]:
+        raise exceptions.NotLoggedInException()
@@ -0,0 +1,325 @@
+"""
+Filesystem watcher driving continuous syncs, as an alternative to Unison
+`-repeat`, which rescans the whole project every couple of seconds. Changes are
+watched with inotify, debounced, and synced by running Unison only for the
+changed paths, with `-path`. A full sync still runs on a long interval, to pick
+up changes on the remote side and anything the watcher missed. Paths ignored
+by the rules of `stolos.ignore` are not watched, and the rules are reloaded
+whenever the ignore files change, before syncing everything. The journal of
+`stolos.journal` is kept up to date from the changes, so that
+`stolos sync --changed` finds it current.
+
+Where inotify is not available, full syncs run on a short interval instead.
+
+Runs as its own process, `python -m stolos.watcher -- unison [ARGS...]`, so
+that it is supervised like the Unison process it replaces.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+import click
+
+from stolos import ignore, journal, metrics
+
+
+# Seconds without further changes before syncing a burst of changes.
+DEBOUNCE = 0.2
+
+# Longest time to wait for a burst of changes to settle before syncing it.
+MAX_DELAY = 2
+
+# Seconds between full syncs, while watching changes.
+FULL_SYNC_INTERVAL = 60
+
+# Seconds between full syncs, when changes cannot be watched.
+POLL_INTERVAL = 2
+
+# inotify flags, from `sys/inotify.h`.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+
+# Header of an inotify event: the watch, mask, cookie and length of the name.
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """
+    Recursive inotify watch of a directory tree. Raises OSError if inotify is
+    not available.
+    """
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or libc_name is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno()
+        self.root = root
+        self.fingerprint = ignore.fingerprint(root)
+        self.matcher = ignore.load(root)
+        self.watches = {}
+        self.add_tree(root)
+
+    def reload(self):
+        """
+        Reloads the ignore rules, if the ignore files changed, compiling them
+        for Unison and watching the directories they no longer ignore. Returns
+        whether they changed.
+        """
+        fingerprint = ignore.fingerprint(self.root)
+        if fingerprint == self.fingerprint:
+            return False
+        self.matcher = ignore.load(self.root)
+        ignore.update(self.root)
+        self.fingerprint = fingerprint
+        self.add_tree(self.root)
+        return True
+
+    def add_tree(self, directory):
+        """
+        Watches the given directory and all its subdirectories, except ignored
+        ones.
+        """
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = [
+                name
+                for name in dirs
+                if not self.matcher.matches(
+                    os.path.relpath(os.path.join(root, name), self.root), True
+                )
+            ]
+            self.add(root)
+
+    def add(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                # Removed before it could be watched.
+                return
+            _raise_errno()
+        self.watches[wd] = directory
+
+    def read(self, timeout):
+        """
+        Waits at most `timeout` seconds for changes, returning the changed
+        paths relative to the root. Returns None if changes were lost, as
+        when the event queue overflowed, so that everything must be synced.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        paths = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except (BlockingIOError, InterruptedError):
+            return paths
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            relative = os.path.relpath(path, self.root)
+            if relative == os.curdir or self.matcher.matches(
+                relative, bool(mask & IN_ISDIR)
+            ):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.add_tree(path)
+                except OSError:
+                    # Out of watches, so changes in it would be missed.
+                    return None
+            paths.add(relative)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _raise_errno():
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code))
+
+
+def collapse(paths):
+    """
+    Returns the given relative paths without those inside any other one, as
+    syncing a directory syncs everything in it.
+    """
+    collapsed = []
+    for path in sorted(paths):
+        if collapsed and path.startswith(collapsed[-1] + os.sep):
+            continue
+        collapsed.append(path)
+    return collapsed
+
+
+def unison(command, paths=None):
+    """
+    Runs the given Unison command, for the given relative paths only, or for
+    everything if None, recording its statistics. Its output is only printed if
+    it fails. Returns its exit code.
+    """
+    args = list(command) + ["-batch", "-silent=false"]
+    for path in paths or []:
+        args.extend(["-path", path.replace(os.sep, "/")])
+    kind = "full" if paths is None else "watch"
+    stats, output = metrics.run(args, kind, len(paths or []))
+    if stats.returncode != 0:
+        click.echo(output, nl=False)
+    return stats.returncode
+
+
+def watch(command, full_sync_interval=FULL_SYNC_INTERVAL):
+    """
+    Syncs the current directory with the given Unison command whenever it
+    changes, until Unison fails fatally. Returns the exit code of Unison.
+    """
+    try:
+        inotify = Inotify(os.getcwd())
+    except OSError as e:
+        click.echo("Could not watch changes ({}), syncing periodically".format(e))
+        return poll(command)
+    try:
+        next_full_sync = 0
+        # The journal is walked again on start, and whenever changes are lost.
+        entries, rescan = journal.load() or {}, True
+        while True:
+            if time.time() >= next_full_sync:
+                changed = paths = None
+            else:
+                changed = inotify.read(max(0, next_full_sync - time.time()))
+                if changed is not None and not changed:
+                    continue
+                changed = paths = _debounce(inotify, changed)
+                rescan = rescan or changed is None
+            try:
+                reloaded = inotify.reload()
+            except (IOError, OSError):
+                # Not compiled, or out of watches, so sync everything.
+                reloaded = True
+            if reloaded:
+                # Paths no longer ignored have changes of their own.
+                changed = paths = None
+                rescan = True
+            if paths is not None and len(paths) > journal.MAX_PATHS:
+                paths = None
+            if paths is None:
+                next_full_sync = time.time() + full_sync_interval
+            # Journal entries are taken before syncing, so that changes made
+            # while syncing are still reported afterwards.
+            if rescan:
+                pending = journal.scan(entries)[0]
+            elif changed:
+                pending = journal.refresh(dict(entries), changed, inotify.matcher)
+            else:
+                pending = None
+            returncode = unison(command, None if paths is None else collapse(paths))
+            if returncode >= 3:
+                return returncode
+            if returncode == 0 and pending is not None:
+                entries, rescan = pending, False
+                try:
+                    journal.save(entries)
+                except (IOError, OSError):
+                    pass
+    finally:
+        inotify.close()
+
+
+def _debounce(inotify, paths):
+    """
+    Collects further changes, until none happen for `DEBOUNCE` seconds or
+    `MAX_DELAY` passes, returning all the changed paths, or None if changes
+    were lost.
+    """
+    deadline = time.time() + MAX_DELAY
+    while paths is not None:
+        timeout = min(DEBOUNCE, deadline - time.time())
+        if timeout <= 0:
+            break
+        more = inotify.read(timeout)
+        if more is None:
+            return None
+        if not more:
+            break
+        paths |= more
+    return paths
+
+
+def poll(command, interval=POLL_INTERVAL):
+    """
+    Syncs everything on the given interval, until Unison fails fatally.
+    Returns the exit code of Unison.
+    """
+    while True:
+        ignore.update()
+        returncode = unison(command)
+        if returncode >= 3:
+            return returncode
+        time.sleep(interval)
+
+
+def _terminate(*args):
+    # Unison is killed by `metrics.run` when interrupted.
+    raise KeyboardInterrupt()
+
+
+@click.command(context_settings=dict(ignore_unknown_options=True))
+@click.option(
+    "--full-sync-interval",
+    default=FULL_SYNC_INTERVAL,
+    type=click.IntRange(1),
+    help="Seconds between full syncs.",
+)
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED)
+def main(full_sync_interval, command):
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        sys.exit(watch(command, full_sync_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Tests for the retries of the API client, using a fake transport adapter and a
+patched sleep, so that no request leaves the process and no test waits.
+"""
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+from requests.adapters import BaseAdapter
+
+from stolos import api
+
+
+class FakeAdapter(BaseAdapter):
+    """
+    Transport adapter answering requests from a list of outcomes, either
+    `(status, headers)` tuples or exceptions to raise.
+    """
+
+    def __init__(self, outcomes):
+        super(FakeAdapter, self).__init__()
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        status, headers = outcome
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response.request = request
+        response.url = request.url
+        response._content = b"{}"
+        return response
+
+    def close(self):
+        pass
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(api.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client(self, outcomes, **kwargs):
+        client = api.Client("https://api.example.com", retry=api.RetryPolicy(**kwargs))
+        adapter = FakeAdapter(outcomes)
+        client.session.mount("https://", adapter)
+        return client, adapter
+
+    def delays(self):
+        return [call[0][0] for call in self.sleep.call_args_list]
+
+    def test_retries_transient_statuses(self):
+        client, adapter = self.client([(502, {}), (504, {}), (200, {})])
+        self.assertEqual(client.get("projects").status_code, 200)
+        self.assertEqual(len(adapter.requests), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_does_not_retry_other_statuses(self):
+        client, adapter = self.client([(500, {}), (200, {})])
+        self.assertEqual(client.get("projects").status_code, 500)
+        self.assertEqual(len(adapter.requests), 1)
+
+    def test_does_not_retry_non_idempotent_methods(self):
+        client, adapter = self.client([(503, {}), (201, {})])
+        self.assertEqual(client.post("projects").status_code, 503)
+        self.assertEqual(len(adapter.requests), 1)
+
+    def test_gives_up_after_retries(self):
+        client, adapter = self.client([(503, {})] * 5, retries=2)
+        self.assertEqual(client.get("projects").status_code, 503)
+        self.assertEqual(len(adapter.requests), 3)
+
+    def test_backoff_is_jittered_and_capped(self):
+        client, _ = self.client(
+            [(502, {})] * 6 + [(200, {})], retries=6, backoff=1, max_backoff=4
+        )
+        with mock.patch.object(api.random, "uniform", side_effect=lambda a, b: b):
+            client.get("projects")
+        self.assertEqual(self.delays(), [1, 2, 4, 4, 4, 4])
+
+    def test_jitter_is_within_the_cap(self):
+        policy = api.RetryPolicy(backoff=1, max_backoff=10)
+        for attempt in range(3):
+            delay = policy._consume(attempt)
+            self.assertTrue(0 <= delay <= 2 ** attempt)
+
+    def test_honours_retry_after_seconds(self):
+        client, _ = self.client([(503, {"Retry-After": "30"}), (200, {})])
+        self.assertEqual(client.get("projects").status_code, 200)
+        self.assertEqual(self.delays(), [30])
+
+    def test_honours_retry_after_date(self):
+        with mock.patch.object(api.time, "time", return_value=784111767):
+            client, _ = self.client(
+                [(429, {"Retry-After": "Sun, 06 Nov 1994 08:49:47 GMT"}), (200, {})]
+            )
+            client.get("projects")
+        self.assertEqual(self.delays(), [20])
+
+    def test_gives_up_beyond_max_retry_after(self):
+        client, adapter = self.client(
+            [(503, {"Retry-After": "300"}), (200, {})], max_retry_after=120
+        )
+        self.assertEqual(client.get("projects").status_code, 503)
+        self.assertEqual(len(adapter.requests), 1)
+
+    def test_ignores_retry_after_on_other_statuses(self):
+        client, _ = self.client([(502, {"Retry-After": "300"}), (200, {})])
+        self.assertEqual(client.get("projects").status_code, 200)
+        self.assertLessEqual(self.delays()[0], 0.25)
+
+    def test_budget_is_shared_by_requests(self):
+        client, adapter = self.client([(503, {})] * 3 + [(200, {})] * 2, budget=2)
+        self.assertEqual(client.get("projects").status_code, 503)
+        self.assertEqual(client.get("projects").status_code, 200)
+        self.assertEqual(len(adapter.requests), 4)
+        self.assertEqual(client.retry.budget, 0)
+
+    def test_retries_connect_timeouts_of_any_method(self):
+        client, adapter = self.client([requests.exceptions.ConnectTimeout(), (201, {})])
+        self.assertEqual(client.post("projects").status_code, 201)
+        self.assertEqual(len(adapter.requests), 2)
+
+    def test_does_not_retry_read_timeouts_of_non_idempotent_methods(self):
+        client, _ = self.client([requests.exceptions.ReadTimeout(), (201, {})])
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            client.post("projects")
+
+
+class ConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(api._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_threads_share_a_single_client(self):
+        credentials = {"host": "api.example.com", "token": "token"}
+        with ThreadPoolExecutor(16) as executor:
+            clients = list(
+                executor.map(lambda _: api.get_client(credentials), range(64))
+            )
+        self.assertEqual(len(set(map(id, clients))), 1)
+
+    def test_threads_do_not_overspend_the_budget(self):
+        policy = api.RetryPolicy(retries=100, budget=50)
+        with ThreadPoolExecutor(16) as executor:
+            delays = list(executor.map(lambda _: policy._consume(0), range(200)))
+        self.assertEqual(len([delay for delay in delays if delay is not None]), 50)
+        self.assertEqual(policy.budget, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
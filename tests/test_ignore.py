@@ -0,0 +1,195 @@
+"""
+Tests for the ignore rules of a project: parsing ignore files, compiling them
+to Unison preferences, and matching paths like Unison would.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from stolos import ignore
+
+
+def rules(text, anchored=False):
+    return [
+        (rule.negated, rule.pattern, rule.anchored, rule.directory_only)
+        for rule in ignore.parse(text.splitlines(), anchored)
+    ]
+
+
+def matcher(gitignore="", dockerignore=""):
+    return ignore.Matcher(
+        ignore.parse(gitignore.splitlines())
+        + ignore.parse(dockerignore.splitlines(), anchored=True)
+    )
+
+
+class ParseTest(unittest.TestCase):
+    def test_skips_comments_and_blank_lines(self):
+        self.assertEqual(
+            rules("# comment\n\n  \nbuild\n"), [(False, "build", False, False)]
+        )
+
+    def test_patterns_with_a_slash_are_anchored(self):
+        self.assertEqual(
+            rules("/build\nsrc/gen\nnode_modules/\n"),
+            [
+                (False, "build", True, False),
+                (False, "src/gen", True, False),
+                (False, "node_modules", False, True),
+            ],
+        )
+
+    def test_negated_and_escaped_patterns(self):
+        self.assertEqual(
+            rules("!keep\n\\!bang\n\\#hash\n"),
+            [
+                (True, "keep", False, False),
+                (False, "!bang", False, False),
+                (False, "#hash", False, False),
+            ],
+        )
+
+    def test_trailing_spaces(self):
+        self.assertEqual(
+            rules("a  \nb\\ \n"),
+            [(False, "a", False, False), (False, "b\\ ", False, False)],
+        )
+
+    def test_leading_double_star(self):
+        self.assertEqual(
+            rules("**/logs\n**/a/b\n"),
+            [(False, "logs", False, False), (False, "**/a/b", True, False)],
+        )
+
+    def test_dockerignore_patterns_are_anchored(self):
+        self.assertEqual(
+            rules("build\n", anchored=True), [(False, "build", True, False)]
+        )
+
+    def test_dockerignore_patterns_are_cleaned(self):
+        self.assertEqual(
+            rules("./build\n.//dist/\n!./keep\n./\n", anchored=True),
+            [
+                (False, "build", True, False),
+                (False, "dist", True, True),
+                (True, "keep", True, False),
+            ],
+        )
+
+
+class ToUnisonTest(unittest.TestCase):
+    def unison(self, text, anchored=False):
+        return [rule.to_unison() for rule in ignore.parse(text.splitlines(), anchored)]
+
+    def test_names_and_paths(self):
+        self.assertEqual(
+            self.unison("*.pyc\n/build\n!keep\n"),
+            ["ignore = Name *.pyc", "ignore = Path build", "ignorenot = Name keep"],
+        )
+
+    def test_escapes_unison_glob_characters(self):
+        self.assertEqual(self.unison("a{b},c\n"), ["ignore = Name a\\{b\\}\\,c"])
+
+    def test_double_star_compiles_to_a_regex(self):
+        self.assertEqual(
+            self.unison("a/**/b\nlogs/**\n"),
+            ["ignore = Regex a/(.*/)?b", "ignore = Regex logs/.*"],
+        )
+
+    def test_unanchored_regex_matches_at_any_depth(self):
+        self.assertEqual(self.unison("**/a/**\n"), ["ignore = Regex (.*/)?a/.*"])
+        rule = ignore.Rule(False, "a/**", False, False)
+        self.assertEqual(rule.to_unison(), "ignore = Regex (.*/)?a/.*")
+
+
+class MatcherTest(unittest.TestCase):
+    def test_unanchored_patterns_match_at_any_depth(self):
+        m = matcher("*.pyc\n")
+        self.assertTrue(m.matches("a.pyc"))
+        self.assertTrue(m.matches("src/a.pyc"))
+        self.assertFalse(m.matches("a.py"))
+
+    def test_anchored_patterns_match_at_the_root(self):
+        m = matcher("/build\n", "dist\n")
+        self.assertTrue(m.matches("build", True))
+        self.assertFalse(m.matches("src/build", True))
+        self.assertTrue(m.matches("dist", True))
+        self.assertFalse(m.matches("src/dist", True))
+
+    def test_directory_only_patterns(self):
+        m = matcher("logs/\n")
+        self.assertTrue(m.matches("logs", is_dir=True))
+        self.assertFalse(m.matches("logs", is_dir=False))
+
+    def test_stolos_directory_is_always_ignored(self):
+        self.assertTrue(matcher().matches(".stolos", True))
+
+    def test_negated_patterns_override_all_others(self):
+        m = matcher("!.env.example\n", ".env*\n")
+        self.assertTrue(m.matches(".env"))
+        self.assertFalse(m.matches(".env.example"))
+        m = matcher("*.log\n!keep.log\n*.log\n")
+        self.assertFalse(m.matches("keep.log"))
+        self.assertTrue(m.matches("other.log"))
+
+    def test_is_ignored_checks_parent_directories(self):
+        m = matcher("node_modules/\n!package.json\n")
+        self.assertTrue(m.is_ignored("node_modules/a/index.js"))
+        self.assertTrue(m.is_ignored("node_modules/a/package.json"))
+        self.assertFalse(m.is_ignored("src/package.json"))
+
+    def test_double_star(self):
+        m = matcher("a/**/b\n")
+        self.assertTrue(m.matches("a/b"))
+        self.assertTrue(m.matches("a/x/y/b"))
+        self.assertFalse(m.matches("c/a/b"))
+
+    def test_character_classes(self):
+        m = matcher("file[0-9]\nx[!a]\n")
+        self.assertTrue(m.matches("file1"))
+        self.assertFalse(m.matches("filea"))
+        self.assertTrue(m.matches("xb"))
+        self.assertFalse(m.matches("xa"))
+
+
+class LoadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        os.mkdir(os.path.join(self.directory, ".stolos"))
+
+    def write(self, name, content):
+        with open(os.path.join(self.directory, name), "w") as fout:
+            fout.write(content)
+
+    def test_load_reads_all_sources(self):
+        self.write(".gitignore", "*.pyc\n")
+        self.write(".dockerignore", "./build\n")
+        self.write(".stolosignore", "!.git\n")
+        m = ignore.load(self.directory)
+        self.assertTrue(m.matches("src/a.pyc"))
+        self.assertTrue(m.matches("build", True))
+        self.assertFalse(m.matches(".git", True))
+
+    def test_git_is_ignored_by_default(self):
+        self.assertTrue(ignore.load(self.directory).matches("src/.git", True))
+
+    def test_update_compiles_when_sources_change(self):
+        self.write(".gitignore", "*.pyc\n")
+        fingerprint = ignore.fingerprint(self.directory)
+        ignore.update(self.directory)
+        path = os.path.join(self.directory, ignore.IGNORE_PROFILE)
+        with open(path) as fin:
+            lines = fin.read().splitlines()
+        self.assertIn(fingerprint, lines[0])
+        self.assertEqual(lines[1:], ["ignore = Name .git", "ignore = Name *.pyc"])
+        self.write(".gitignore", "*.pyo\n")
+        self.assertNotEqual(ignore.fingerprint(self.directory), fingerprint)
+        ignore.update(self.directory)
+        with open(path) as fin:
+            self.assertEqual(fin.read().splitlines()[-1], "ignore = Name *.pyo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Regression tests for the startup time of the Stolos CLI, which `stolos env`
+pays in every new shell that evaluates it.
+"""
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+# Most seconds `stolos version` may take to start, run and exit.
+STARTUP_BUDGET = 0.5
+
+# Modules too slow to import for commands that do not need them.
+HEAVY_MODULES = ["requests", "yaml", "tabulate"]
+
+# Runs `stolos version` in a fresh interpreter, then prints the heavy modules
+# it imported.
+SCRIPT = """
+import sys
+sys.argv = ["stolos", "version"]
+import stolos.cli
+try:
+    stolos.cli.main()
+except SystemExit:
+    pass
+print(",".join(name for name in {modules!r} if name in sys.modules))
+"""
+
+
+class StartupTest(unittest.TestCase):
+    def run_version(self):
+        env = dict(os.environ, STOLOS_NO_DAEMON="1")
+        started = time.time()
+        output = subprocess.check_output(
+            [sys.executable, "-c", SCRIPT.format(modules=HEAVY_MODULES)],
+            env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        return output.decode("utf-8").splitlines(), time.time() - started
+
+    def test_version_does_not_import_heavy_modules(self):
+        lines, _ = self.run_version()
+        self.assertEqual(lines[-1], "")
+
+    def test_version_within_budget(self):
+        # The best of a few runs, to leave out a cold filesystem cache.
+        duration = min(self.run_version()[1] for _ in range(3))
+        self.assertLess(duration, STARTUP_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()